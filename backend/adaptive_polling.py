@@ -0,0 +1,99 @@
+"""
+Adaptive polling schedule for Fashn predictions.
+
+Instead of checking every prediction on a fixed interval, the first status
+check waits for a good part of the typical run time, checks tighten as a
+prediction approaches its expected completion, and queued predictions are
+checked with a growing back-off. Expected run time is an exponentially
+weighted average of recent completions.
+"""
+import os
+import math
+import threading
+
+DEFAULT_EXPECTED_DURATION = float(os.environ.get('TRY_ON_EXPECTED_DURATION', '15'))  # Seconds, before any history
+MIN_POLL_INTERVAL = 0.5
+MAX_POLL_INTERVAL = 5.0
+FIRST_POLL_FRACTION = 0.5  # First check after this share of the expected run time
+QUEUE_BACKOFF = 1.5  # Growth factor for checks while a prediction is queued
+BASELINE_INTERVAL = 2  # The old fixed interval, used to report polls saved
+
+
+class AdaptivePollPolicy:
+    """Chooses the delay before the next status check of a prediction"""
+
+    def __init__(self, expected_duration=DEFAULT_EXPECTED_DURATION, min_interval=MIN_POLL_INTERVAL,
+                 max_interval=MAX_POLL_INTERVAL, alpha=0.2):
+        self.expected_duration = expected_duration
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.alpha = alpha
+        self._lock = threading.Lock()
+
+    def first_delay(self):
+        return self._clamp(self.expected_duration * FIRST_POLL_FRACTION)
+
+    def next_delay(self, status, active_since, last_delay, now):
+        """
+        Delay before the next check. `active_since` is when the prediction
+        left the queue (None while it is still queued).
+        """
+        if status == 'in_queue' or active_since is None:
+            return self._clamp(max(last_delay or 0, 1.0) * QUEUE_BACKOFF)
+
+        remaining = active_since + self.expected_duration - now
+        if remaining > 0:
+            # Halve the distance to the expected completion on every check
+            return self._clamp(remaining / 2)
+
+        # Overdue: stay tight at first, then ease off the longer it runs over
+        return self._clamp(self.min_interval + (-remaining) * 0.25)
+
+    def record_completion(self, duration):
+        with self._lock:
+            self.expected_duration += self.alpha * (duration - self.expected_duration)
+
+    def _clamp(self, delay):
+        return min(self.max_interval, max(self.min_interval, delay))
+
+
+class PollingStats:
+    """Polls per prediction and completion-detection lag, for verifying the schedule"""
+
+    def __init__(self):
+        self.predictions = 0
+        self.polls = 0
+        self.baseline_polls = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, polls, lag_bound, duration):
+        """
+        `lag_bound` is the time between the last pending check and the check
+        that saw the completion; the actual lag is somewhere inside it.
+        """
+        with self._lock:
+            self.predictions += 1
+            self.polls += polls
+            self.baseline_polls += max(1, math.ceil(duration / BASELINE_INTERVAL))
+            self.lag_total += lag_bound / 2
+            self.lag_max = max(self.lag_max, lag_bound)
+
+    def snapshot(self, policy=None):
+        with self._lock:
+            data = {
+                'predictions': self.predictions,
+                'polls': self.polls,
+                'polls_per_prediction': round(self.polls / self.predictions, 2) if self.predictions else None,
+                'fixed_interval_polls': self.baseline_polls,
+                'detection_lag_ms': {
+                    'mean_estimate': round(self.lag_total / self.predictions * 1000, 1) if self.predictions else None,
+                    'max_bound': round(self.lag_max * 1000, 1)
+                }
+            }
+
+        if policy is not None:
+            data['expected_duration_s'] = round(policy.expected_duration, 2)
+
+        return data
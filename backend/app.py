@@ -1,37 +1,57 @@
 import os
 import time
-import requests
 import json
-from flask import Flask, request, jsonify, send_from_directory
+import base64
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-import base64
+from werkzeug.middleware.proxy_fix import ProxyFix
 from bson.objectid import ObjectId
 from flask_bcrypt import Bcrypt
 import datetime
-import tempfile
-import openai
 from clip_index.search_clip import search_similar_products_clip
 
 
 # Import database and authentication modules
-from db import test_connection, users, try_on_history, user_photos, wardrobe_items, get_all_tags, get_category_for_tag
-from auth import token_required, register_user, authenticate_user, generate_token
+from db import test_connection, get_all_tags, get_category_for_tag
+import repository
+from mongo_monitoring import command_timer
+from indexes import ensure_indexes
+from auth import token_required, register_user, authenticate_user, generate_token, user_cache
+from password_hashing import password_hasher, PasswordHashingBusy
+from tryon_jobs import job_manager, FINISHED_STATUSES
+from tryon_cache import result_cache
+from outfit_cache import suggestion_cache, suggestion_key
+from outfit_ranking import shortlist, compact_items, count_tokens
+from outfit_engine import suggest_outfits, OUTFIT_COUNT
+from garment_descriptions import description_queue, description_fields
+from description_cache import garment_description_cache
+from json_stream import ArrayItemStream
+from images import normalize_image, normalize_upload, normalize_data_uri, decode_data_uri, image_stats
+from blob_store import (
+    put_blob, get_blob, parse_image_ref, doc_image_url, doc_image_urls,
+    doc_image_data, doc_images_data, owns_blob, verify_image_link
+)
+from http_cache import versioned, immutable_response, not_modified, IMMUTABLE
+from renditions import schedule_renditions, get_rendition, doc_rendition_url, doc_rendition_urls, SIZES
+from http_clients import openai_api, get_openai_client, upstream_stats
+from weather_service import weather_service, grid_cell, WeatherUnavailable, WEATHER_API_KEY
+from outfit_precompute import OutfitPrecomputer, PRECOMPUTE_ENABLED, PRECOMPUTE_LLM_BUDGET
 
 # Initialize Flask app
 app = Flask(__name__, static_folder='../frontend/build')
 CORS(app)  # Enable CORS for all routes
 bcrypt = Bcrypt(app)
 
+# Reverse proxies in front of the app; only their X-Forwarded-For entries are
+# trusted for request.remote_addr. With none, the header is ignored.
+PROXY_FIX_HOPS = int(os.environ.get('PROXY_FIX_HOPS', '0'))
+if PROXY_FIX_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_FIX_HOPS, x_proto=PROXY_FIX_HOPS)
+
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
-BASE_URL = "https://api.fashn.ai/v1"
-API_KEY = os.environ.get('FASHN_AI_API_KEY', '')  # Get API key from environment variable
-MAX_POLLING_TIME = 120  # Maximum polling time in seconds
-POLLING_INTERVAL = 2  # Time between status checks in seconds
-WEATHER_API_KEY = os.environ.get('WEATHER_API_KEY', '')  # API key for weather service
-openai.api_key = os.environ.get('OPENAI_API_KEY', '')
 print(f'Weather api key loaded correctly: {WEATHER_API_KEY}')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
@@ -40,14 +60,54 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-key-for-development
 # Create uploads directory if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# Check database connection on startup
-with app.app_context():
-    test_connection()
+# Password hashing workers import this module again as __mp_main__ when it is
+# run directly; only the app process starts background work
+IS_APP_PROCESS = __name__ != '__mp_main__'
+
+# Check database connection and indexes on startup
+if IS_APP_PROCESS:
+    with app.app_context():
+        if test_connection():
+            ensure_indexes()
+    # Requeues AI descriptions whose worker was lost, now and periodically
+    description_queue.start()
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def with_job_urls(job):
+    # Point clients at the status and progress stream endpoints for a try-on job
+    job['status_url'] = f"/api/try-on/jobs/{job['job_id']}"
+    job['events_url'] = f"/api/try-on/jobs/{job['job_id']}/events"
+    return job
+
+def store_upload(image_file, owner, target='fashn'):
+    # Normalize an uploaded image and keep it in the blob store
+    data, mime_type = normalize_image(image_file.read(), target)
+    image_id = put_blob(data, mime_type, owner)
+    schedule_renditions(image_id)
+    return image_id
+
+def store_image_value(value, owner, target='fashn'):
+    # References to the owner's stored images pass through; inline images are normalized and stored
+    image_id = parse_image_ref(value)
+    if image_id:
+        if not owns_blob(image_id, owner):
+            raise ValueError(f"Image {image_id} not found")
+        return image_id
+    data, mime_type = normalize_image(decode_data_uri(value), target)
+    image_id = put_blob(data, mime_type, owner)
+    schedule_renditions(image_id)
+    return image_id
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def wants_event_stream():
+    # Clients opt into streamed responses with Accept: text/event-stream
+    return request.accept_mimetypes.best_match(['application/json', 'text/event-stream']) == 'text/event-stream'
+
 # Authentication Routes
 @app.route('/api/register', methods=['POST'])
 def register():
@@ -58,13 +118,16 @@ def register():
         return jsonify({'error': 'Email, password, and name are required'}), 400
     
     # Register the user
-    user_id, error = register_user(data['email'], data['password'], data['name'])
+    try:
+        user_id, error = register_user(data['email'], data['password'], data['name'])
+    except PasswordHashingBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     
     if error:
         return jsonify({'error': error}), 400
     
     # Generate token
-    token = generate_token(user_id)
+    token = generate_token(user_id, {'email': data['email'], 'name': data['name']})
     
     return jsonify({
         'message': 'User registered successfully',
@@ -85,13 +148,16 @@ def login():
         return jsonify({'error': 'Email and password are required'}), 400
     
     # Authenticate the user
-    user, error = authenticate_user(data['email'], data['password'])
+    try:
+        user, error = authenticate_user(data['email'], data['password'])
+    except PasswordHashingBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     
     if error:
         return jsonify({'error': error}), 401
     
     # Generate token
-    token = generate_token(str(user['_id']))
+    token = generate_token(str(user['_id']), user)
     
     return jsonify({
         'message': 'Login successful',
@@ -130,134 +196,145 @@ def try_on(current_user):
     if not allowed_file(model_image.filename) or not allowed_file(garment_image.filename):
         return jsonify({'error': 'Only image files (png, jpg, jpeg) are allowed'}), 400
     
-    # Save files temporarily
-    model_filename = secure_filename(model_image.filename)
-    garment_filename = secure_filename(garment_image.filename)
-    
-    model_path = os.path.join(app.config['UPLOAD_FOLDER'], model_filename)
-    garment_path = os.path.join(app.config['UPLOAD_FOLDER'], garment_filename)
-    
-    model_image.save(model_path)
-    garment_image.save(garment_path)
-    
-    # Convert images to base64 for API
-    with open(model_path, "rb") as f:
-        model_data = base64.b64encode(f.read()).decode('utf-8')
-    
-    with open(garment_path, "rb") as f:
-        garment_data = base64.b64encode(f.read()).decode('utf-8')
-    
-    # Save model and garment data to variables before removing files
-    model_image_base64 = f"data:image/jpeg;base64,{model_data}"
-    garment_image_base64 = f"data:image/jpeg;base64,{garment_data}"
-    
-    # Clean up temporary files after reading them
-    os.remove(model_path)
-    os.remove(garment_path)
-    
-    # Step 1: Submit the prediction request
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
+    # Downscale and re-encode for Fashn
+    try:
+        model_image_base64 = normalize_upload(model_image, 'fashn')
+        garment_image_base64 = normalize_upload(garment_image, 'fashn')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
+    # Queue the prediction; the job manager submits it and polls Fashn in the background
+    job = job_manager.submit(str(current_user['_id']), model_image_base64, garment_image_base64)
+
+    return jsonify(with_job_urls(job)), 202
+
+@app.route('/api/try-on/jobs/<job_id>', methods=['GET'])
+@token_required
+def get_try_on_job(current_user, job_id):
+    # Lightweight status lookup for a queued try-on
+    job = job_manager.get_status(job_id, str(current_user['_id']))
+
+    if not job:
+        return jsonify({'error': 'Try-on job not found'}), 404
+
+    return jsonify(job), 200
+
+@app.route('/api/try-on/jobs/<job_id>/events', methods=['GET'])
+@token_required
+def stream_try_on_job(current_user, job_id):
+    # Server-sent events with every state transition of a try-on job
+    user_id = str(current_user['_id'])
+
+    if not job_manager.get_status(job_id, user_id):
+        return jsonify({'error': 'Try-on job not found'}), 404
+
+    def generate():
+        # The stream is capped (WATCH_MAX_DURATION); 'retry' tells the client to
+        # reconnect, or to poll the status endpoint, for the rest of the job
+        finished = False
+        for snapshot in job_manager.watch(job_id, user_id):
+            if snapshot is None:
+                yield ": keep-alive\n\n"
+            else:
+                finished = snapshot['status'] in FINISHED_STATUSES
+                yield sse_event('status', snapshot)
+        if not finished:
+            yield sse_event('retry', {'status_url': f"/api/try-on/jobs/{job_id}"})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# Fashn garment categories for wardrobe categories it can dress
+FASHN_CATEGORIES = {
+    'Tops': 'tops',
+    'Outerwear': 'tops',
+    'Bottoms': 'bottoms',
+    'Dresses & Jumpsuits': 'one-pieces'
+}
+MAX_BATCH_TRY_ON = 10
+
+@app.route('/api/try-on/batch', methods=['POST'])
+@token_required
+def batch_try_on(current_user):
+    # Try one saved photo against several garments; results stream back as they finish
+    user_id = str(current_user['_id'])
+    photo_id = request.form.get('photo_id')
+    garment_files = [f for f in request.files.getlist('garment_images[]') if f.filename != '']
+    item_ids = request.form.getlist('wardrobe_item_ids[]')
+
+    if not photo_id or not (garment_files or item_ids):
+        return jsonify({'error': 'A photo ID and at least one garment are required'}), 400
+
+    if len(set(item_ids)) != len(item_ids):
+        return jsonify({'error': 'Each wardrobe item can only be tried on once per batch'}), 400
+
+    if len(garment_files) + len(item_ids) > MAX_BATCH_TRY_ON:
+        return jsonify({'error': f'Maximum {MAX_BATCH_TRY_ON} garments per batch'}), 400
+
+    if not all(allowed_file(f.filename) for f in garment_files):
+        return jsonify({'error': 'Only image files (png, jpg, jpeg) are allowed'}), 400
+
+    photo = repository.get_photo(user_id, photo_id)
+    if not photo:
+        return jsonify({'error': 'Photo not found'}), 404
+
     try:
-        # Start the prediction
-        run_response = requests.post(
-            f"{BASE_URL}/run",
-            headers=headers,
-            json={
-                "model_image": model_image_base64,
-                "garment_image": garment_image_base64,
-                "category": "auto",
-            },
-            timeout=30  # 30 seconds timeout for initial request
+        model_image_base64 = normalize_data_uri(doc_image_data(photo, 'image_id', 'image'), 'fashn')
+        garments = [(normalize_upload(garment_file, 'fashn'), 'auto') for garment_file in garment_files]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if item_ids:
+        items = repository.find_wardrobe_items(
+            user_id, item_ids,
+            {'image_ids': {'$slice': 1}, 'images': {'$slice': 1}, 'category': 1}
         )
-        
-        if run_response.status_code != 200:
-            return jsonify({
-                'error': f'API request failed with status code {run_response.status_code}',
-                'details': run_response.text
-            }), 500
-        
-        # Get the prediction ID
-        run_data = run_response.json()
-        prediction_id = run_data.get("id")
-        
-        if not prediction_id:
-            return jsonify({'error': 'Failed to get prediction ID from API response'}), 500
-        
-        # Step 2: Poll for status until complete (or timeout)
-        start_time = time.time()
-        while (time.time() - start_time) < MAX_POLLING_TIME:
-            status_response = requests.get(
-                f"{BASE_URL}/status/{prediction_id}", 
-                headers=headers,
-                timeout=10
-            )
-            
-            if status_response.status_code != 200:
-                return jsonify({
-                    'error': f'Status check failed with status code {status_response.status_code}',
-                    'details': status_response.text
-                }), 500
-            
-            status_data = status_response.json()
-            status = status_data.get("status")
-            
-            if status == "completed":
-                # Success! Add to user's history
-                result_image = status_data.get("output")
-                
-                # Create history record
-                history_record = {
-                    'user_id': str(current_user['_id']),
-                    'model_image': model_image_base64,
-                    'garment_image': garment_image_base64,
-                    'result_image': result_image,
-                    'prediction_id': prediction_id,
-                    'created_at': time.time()
-                }
-                
-                # Save to database
-                try_on_history.insert_one(history_record)
-                
-                # Return the output data to the frontend
-                return jsonify({
-                    'status': 'success',
-                    'result_image': result_image,
-                    'garment_image': garment_image_base64,
-                    'prediction_id': prediction_id
-                })
-            
-            elif status in ["starting", "in_queue", "processing"]:
-                # Still processing, wait and try again
-                time.sleep(POLLING_INTERVAL)
-                continue
-            
+        if len(items) != len(item_ids):
+            return jsonify({'error': 'Wardrobe item not found'}), 404
+
+        # Jobs are returned in the order the items were requested
+        items.sort(key=lambda item: item_ids.index(str(item['_id'])))
+        for item in items:
+            item_images = doc_images_data(item, 'image_ids', 'images')
+            if not item_images:
+                return jsonify({'error': 'Wardrobe item has no image'}), 400
+            garments.append((item_images[0], FASHN_CATEGORIES.get(item['category'], 'auto')))
+
+    # The photo is normalized once; every job shares the same encoded string
+    jobs = [with_job_urls(job) for job in job_manager.submit_batch(user_id, model_image_base64, garments)]
+
+    def generate():
+        yield sse_event('batch', {'jobs': jobs})
+        finished = set()
+        for snapshot in job_manager.watch_many([job['job_id'] for job in jobs], user_id):
+            if snapshot is None:
+                yield ": keep-alive\n\n"
             else:
-                # Failed or unknown status
-                error_message = status_data.get("error", "Unknown error occurred")
-                return jsonify({
-                    'error': f'Prediction failed with status: {status}',
-                    'details': error_message
-                }), 500
-        
-        # If we get here, we've timed out
-        return jsonify({
-            'error': f'Prediction timed out after {MAX_POLLING_TIME} seconds',
-            'prediction_id': prediction_id
-        }), 504
-        
-    except Exception as e:
-        return jsonify({'error': f'API request failed: {str(e)}'}), 500
+                if snapshot['status'] in FINISHED_STATUSES:
+                    finished.add(snapshot['job_id'])
+                yield sse_event('status', snapshot)
+        if len(finished) < len(jobs):
+            # Capped stream; the rest is available from each job's status and events URLs
+            yield sse_event('retry', {'jobs': [job for job in jobs if job['job_id'] not in finished]})
+        else:
+            yield sse_event('done', {'count': len(jobs)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 # User Photos endpoints
 @app.route('/api/photos', methods=['GET'])
 @token_required
+@versioned('photos')
 def get_user_photos(current_user):
     # Get all photos for the current user
-    photos = list(user_photos.find({'user_id': str(current_user['_id'])}).sort('created_at', -1))
+    photos = repository.list_photos(current_user['_id'])
     
     # Format for JSON response
     formatted_photos = []
@@ -265,7 +342,8 @@ def get_user_photos(current_user):
         formatted_photos.append({
             'id': str(photo['_id']),
             'name': photo.get('name', 'Photo'),
-            'image': photo['image'],
+            'image': doc_image_url(photo, 'image_id', 'image', current_user['_id']),
+            'thumbnail': doc_rendition_url(photo, 'image_id', 'thumb', current_user['_id']),
             'created_at': photo['created_at']
         })
     
@@ -287,50 +365,36 @@ def upload_user_photo(current_user):
     if not allowed_file(photo.filename):
         return jsonify({'error': 'Only image files (png, jpg, jpeg) are allowed'}), 400
     
-    # Save file temporarily
-    filename = secure_filename(photo.filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    photo.save(filepath)
-    
-    # Convert to base64
-    with open(filepath, "rb") as f:
-        photo_data = base64.b64encode(f.read()).decode('utf-8')
-    
-    # Clean up temporary file
-    os.remove(filepath)
+    # Saved photos are only used for try-ons, so store them at Fashn size
+    try:
+        image_id = store_upload(photo, current_user['_id'], 'fashn')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     # Save to database
     photo_record = {
-        'user_id': str(current_user['_id']),
         'name': name,
-        'image': f"data:image/jpeg;base64,{photo_data}",
+        'image_id': image_id,
         'created_at': time.time()
     }
     
-    result = user_photos.insert_one(photo_record)
+    photo_id = repository.add_photo(current_user['_id'], photo_record)
     
     return jsonify({
-        'id': str(result.inserted_id),
+        'id': str(photo_id),
         'name': name,
-        'image': photo_record['image'],
+        'image': doc_image_url(photo_record, 'image_id', 'image', current_user['_id']),
+        'thumbnail': doc_rendition_url(photo_record, 'image_id', 'thumb', current_user['_id']),
         'created_at': photo_record['created_at']
     }), 201
 
 @app.route('/api/photos/<photo_id>', methods=['DELETE'])
 @token_required
 def delete_user_photo(current_user, photo_id):
-    # Find the photo
-    photo = user_photos.find_one({
-        '_id': ObjectId(photo_id), 
-        'user_id': str(current_user['_id'])
-    })
-    
-    if not photo:
+    # Delete the photo if it is the user's
+    if not repository.delete_photo(current_user['_id'], photo_id):
         return jsonify({'error': 'Photo not found'}), 404
     
-    # Delete the photo
-    user_photos.delete_one({'_id': ObjectId(photo_id)})
-    
     return jsonify({'message': 'Photo deleted successfully'}), 200
 
 # Try-on with saved photo
@@ -343,10 +407,7 @@ def try_on_with_saved(current_user):
         return jsonify({'error': 'Both photo ID and garment image are required'}), 400
 
     # Find the user's photo
-    photo = user_photos.find_one({
-        '_id': ObjectId(photo_id),
-        'user_id': str(current_user['_id'])
-    })
+    photo = repository.get_photo(current_user['_id'], photo_id)
 
     if not photo:
         return jsonify({'error': 'Photo not found'}), 404
@@ -360,202 +421,80 @@ def try_on_with_saved(current_user):
     if not allowed_file(garment_image.filename):
         return jsonify({'error': 'Only image files (png, jpg, jpeg) are allowed'}), 400
 
-    # Save garment file temporarily
-    garment_filename = secure_filename(garment_image.filename)
-    garment_path = os.path.join(app.config['UPLOAD_FOLDER'], garment_filename)
-    garment_image.save(garment_path)
+    # Photos saved before normalization existed may still be full size
+    try:
+        model_image_base64 = normalize_data_uri(doc_image_data(photo, 'image_id', 'image'), 'fashn')
+        garment_image_base64 = normalize_upload(garment_image, 'fashn')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Queue the prediction; the job manager submits it and polls Fashn in the background
+    job = job_manager.submit(str(current_user['_id']), model_image_base64, garment_image_base64)
 
-    # Convert to base64
-    with open(garment_path, "rb") as f:
-        garment_data = base64.b64encode(f.read()).decode('utf-8')
+    return jsonify(with_job_urls(job)), 202
 
-    # Clean up temporary file
-    os.remove(garment_path)
+# History endpoint with enhanced data
+HISTORY_PAGE_SIZE = 20
+MAX_HISTORY_PAGE_SIZE = 50
 
-    model_image_base64 = photo['image']
-    garment_image_base64 = f"data:image/jpeg;base64,{garment_data}"
-    
-    # Make the API request (similar to regular try-on)
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
+def encode_history_cursor(item):
+    raw = f"{item['created_at']!r}:{item['_id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_history_cursor(cursor):
+    """Return (created_at, ObjectId) for a cursor, or raise ValueError"""
     try:
-        # Start the prediction
-        run_response = requests.post(
-            f"{BASE_URL}/run",
-            headers=headers,
-            json={
-                "model_image": model_image_base64,
-                "garment_image": garment_image_base64,
-                "category": "auto",
-            },
-            timeout=30
-        )
-        
-        # Continue with polling and result handling (same as regular try-on)
-        # ... [Rest of the code is similar to the try_on function]
-        
-        if run_response.status_code != 200:
-            return jsonify({
-                'error': f'API request failed with status code {run_response.status_code}',
-                'details': run_response.text
-            }), 500
-        
-        # Get the prediction ID
-        run_data = run_response.json()
-        prediction_id = run_data.get("id")
-        
-        if not prediction_id:
-            return jsonify({'error': 'Failed to get prediction ID from API response'}), 500
-        
-        # Step 2: Poll for status until complete (or timeout)
-        start_time = time.time()
-        while (time.time() - start_time) < MAX_POLLING_TIME:
-            status_response = requests.get(
-                f"{BASE_URL}/status/{prediction_id}", 
-                headers=headers,
-                timeout=10
-            )
-            
-            if status_response.status_code != 200:
-                return jsonify({
-                    'error': f'Status check failed with status code {status_response.status_code}',
-                    'details': status_response.text
-                }), 500
-            
-            status_data = status_response.json()
-            status = status_data.get("status")
-            
-            if status == "completed":
-                # Success! Add to user's history
-                result_image = status_data.get("output")
-                
-                # Create history record
-                history_record = {
-                    'user_id': str(current_user['_id']),
-                    'model_image': model_image_base64,
-                    'garment_image': garment_image_base64,
-                    'result_image': result_image,
-                    'prediction_id': prediction_id,
-                    'created_at': time.time()
-                }
-                
-                # Save to database
-                try_on_history.insert_one(history_record)
-                
-                # Return the output data to the frontend
-                return jsonify({
-                    'status': 'success',
-                    'result_image': result_image,
-                    'garment_image': garment_image_base64,
-                    'prediction_id': prediction_id
-                })
-            
-            elif status in ["starting", "in_queue", "processing"]:
-                # Still processing, wait and try again
-                time.sleep(POLLING_INTERVAL)
-                continue
-            
-            else:
-                # Failed or unknown status
-                error_message = status_data.get("error", "Unknown error occurred")
-                return jsonify({
-                    'error': f'Prediction failed with status: {status}',
-                    'details': error_message
-                }), 500
-        
-        # If we get here, we've timed out
-        return jsonify({
-            'error': f'Prediction timed out after {MAX_POLLING_TIME} seconds',
-            'prediction_id': prediction_id
-        }), 504
-        
-    except Exception as e:
-        return jsonify({'error': f'API request failed: {str(e)}'}), 500
+        created_at, item_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split(':', 1)
+        return float(created_at), ObjectId(item_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
 
-# History endpoint with enhanced data
 @app.route('/api/history', methods=['GET'])
 @token_required
+@versioned('history')
 def get_history(current_user):
-    # Get user's try-on history
-    history = list(try_on_history.find({'user_id': str(current_user['_id'])}).sort('created_at', -1))
-    
+    # Newest first, one page at a time; ?cursor= continues after the previous page
+    try:
+        limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), MAX_HISTORY_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'limit must be a number'}), 400
+
+    after = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after = decode_history_cursor(cursor)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    # Read only; records not yet migrated are shown with their inline garment image
+    history, has_more = repository.history_page(current_user['_id'], limit, after)
+
     # Format for JSON response
     formatted_history = []
     for item in history:
         formatted_history.append({
             'id': str(item['_id']),
             'result_image': item['result_image'],
-            'garment_image': item.get('garment_image', ''), 
+            'garment_image': doc_image_url(item, 'garment_image_id', 'garment_image', current_user['_id']),
+            'garment_medium': doc_rendition_url(item, 'garment_image_id', 'medium', current_user['_id']),
             'prediction_id': item['prediction_id'],
             'created_at': item['created_at']
         })
-    
-    return jsonify(formatted_history), 200
-
-# Wardrobe endpoints
 
-def describe_garment(image_data_list):
-    """
-    Given a list of image data strings (base64), sends them to the OpenAI API
-    and returns a textual description of the garment/clothing item.
-    """
-    if not (1 <= len(image_data_list) <= 5):
-        raise ValueError("You must provide between 1 and 5 images.")
-    
-    # Create temporary files for the images
-    temp_image_paths = []
-    try:
-        for img_data in image_data_list:
-            # Remove the data URI prefix if present
-            if ',' in img_data:
-                img_data = img_data.split(',', 1)[1]
-            
-            # Create a temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-                temp_file.write(base64.b64decode(img_data))
-                temp_image_paths.append(temp_file.name)
-        
-        # Prepare the multimodal content payload
-        content = []
-        for img_path in temp_image_paths:
-            with open(img_path, "rb") as f:
-                img_bytes = f.read()
-            img_b64 = base64.b64encode(img_bytes).decode("utf-8")
-            content.append(
-                {"type": "input_image", 
-                "image_url": f"data:image/png;base64,{img_b64}"}
-            )
-        
-        # Append the user instruction
-        content.append({
-            "type": "input_text",
-            "text": "Please provide a detailed textual description of the garment or clothing item shown in these images."
-        })
-        
-        # Call the ChatGPT API with GPT-4.1 Mini
-        response = openai.responses.create(
-            model="gpt-4.1-mini",
-            input=[{"role": "user", "content": content}]
-        )
-        return response.output_text
-    
-    finally:
-        # Clean up temporary files
-        for path in temp_image_paths:
-            try:
-                os.unlink(path)
-            except Exception as e:
-                print(f"Error removing temporary file: {e}")
+    return jsonify({
+        'items': formatted_history,
+        'next_cursor': encode_history_cursor(history[-1]) if has_more else None
+    }), 200
 
+# Wardrobe endpoints
 
 @app.route('/api/wardrobe', methods=['GET'])
 @token_required
+@versioned('wardrobe')
 def get_wardrobe(current_user):
     # Get all wardrobe items for the current user
-    items = list(wardrobe_items.find({'user_id': str(current_user['_id'])}).sort('created_at', -1))
+    items = repository.list_wardrobe(current_user['_id'])
     
     # Format for JSON response
     formatted_items = []
@@ -569,19 +508,35 @@ def get_wardrobe(current_user):
             'color': item.get('color', ''),
             'in_laundry': item.get('in_laundry', False),
             'unavailable': item.get('unavailable', False),
+            'ai_description_status': item.get('ai_description_status', 'ready'),
             'created_at': item['created_at']
         }
         
-        # Ensure images are properly included
-        if 'images' in item and isinstance(item['images'], list):
-            formatted_item['images'] = item['images']
-        else:
-            formatted_item['images'] = []
+        # Stored images are returned as URLs, with small renditions for the grid
+        formatted_item['images'] = doc_image_urls(item, 'image_ids', 'images', current_user['_id'])
+        formatted_item['thumbnails'] = doc_rendition_urls(item, 'image_ids', 'thumb', current_user['_id'])
         
         formatted_items.append(formatted_item)
     
     return jsonify(formatted_items), 200
 
+@app.route('/api/wardrobe/descriptions', methods=['GET'])
+@token_required
+def get_wardrobe_descriptions(current_user):
+    # AI description status of the given items (?ids=a,b), or of every item still pending or failed
+    ids = [item_id for item_id in request.args.get('ids', '').split(',') if item_id]
+    if ids:
+        items = repository.find_wardrobe_items(current_user['_id'], ids, repository.WARDROBE_DESCRIPTION_FIELDS)
+    else:
+        items = repository.unfinished_descriptions(current_user['_id'])
+    
+    return jsonify([{
+        'id': str(item['_id']),
+        'status': item.get('ai_description_status', 'ready'),
+        'attempts': item.get('ai_description_attempts', 0),
+        'ai_description': item.get('ai_description', '')
+    } for item in items]), 200
+
 @app.route('/api/wardrobe/tags', methods=['GET'])
 def get_wardrobe_tags():
     # Return all clothing tags with their categories and colors
@@ -591,7 +546,7 @@ def get_wardrobe_tags():
 @token_required
 def add_wardrobe_item(current_user):
     data = {}
-    image_data_list = []
+    image_ids = []
     
     # Check if this is a multipart form or JSON
     if request.content_type and 'multipart/form-data' in request.content_type:
@@ -610,20 +565,11 @@ def add_wardrobe_item(current_user):
             for image_file in image_files:
                 if image_file.filename != '':
                     if allowed_file(image_file.filename):
-                        # Save file temporarily
-                        filename = secure_filename(image_file.filename)
-                        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                        image_file.save(filepath)
-                        
-                        # Convert to base64
-                        with open(filepath, "rb") as f:
-                            img_data = base64.b64encode(f.read()).decode('utf-8')
-                        
-                        # Add to image data list
-                        image_data_list.append(f"data:image/jpeg;base64,{img_data}")
-                        
-                        # Clean up temporary file
-                        os.remove(filepath)
+                        # Downscale, re-encode and store the image
+                        try:
+                            image_ids.append(store_upload(image_file, current_user['_id'], 'fashn'))
+                        except ValueError as e:
+                            return jsonify({'error': str(e)}), 400
                     else:
                         return jsonify({'error': 'Only image files (png, jpg, jpeg) are allowed'}), 400
     else:
@@ -634,16 +580,19 @@ def add_wardrobe_item(current_user):
         
         # If there's base64 image data in the JSON
         if 'images' in data and isinstance(data['images'], list):
-            image_data_list = data['images']
+            try:
+                image_ids = [store_image_value(img, current_user['_id'], 'fashn') for img in data['images']]
+            except (ValueError, TypeError) as e:
+                return jsonify({'error': str(e)}), 400
     
     # Validate required fields
     if not data.get('tag'):
         return jsonify({'error': 'Clothing tag is required'}), 400
     
-    if not image_data_list:
+    if not image_ids:
         return jsonify({'error': 'At least one image is required'}), 400
     
-    if len(image_data_list) > 5:
+    if len(image_ids) > 5:
         return jsonify({'error': 'Maximum 5 images allowed'}), 400
     
     # Get category based on tag
@@ -651,20 +600,13 @@ def add_wardrobe_item(current_user):
     if not category:
         return jsonify({'error': 'Invalid clothing tag'}), 400
     
-    # Generate AI description of the garment
-    try:
-        ai_description = describe_garment([img.split(',')[1] if ',' in img else img for img in image_data_list])
-    except Exception as e:
-        print(f"Error generating AI description: {e}")
-        ai_description = "Description could not be generated."
-    
-    # Create wardrobe item
+    # Create wardrobe item; its AI description is generated in the background
     item = {
-        'user_id': str(current_user['_id']),
         'name': data.get('name', ''),
         'fit_description': data.get('fit_description', ''),
-        'images': image_data_list,
-        'ai_description': ai_description,
+        'image_ids': image_ids,
+        'ai_description': '',
+        **description_fields(image_ids),
         'category': category,
         'tag': data['tag'],
         'color': data.get('color', ''),
@@ -674,18 +616,22 @@ def add_wardrobe_item(current_user):
     }
     
     # Save to database
-    result = wardrobe_items.insert_one(item)
+    inserted_id = repository.add_wardrobe_item(current_user['_id'], item)
+    if item['ai_description_status'] == 'pending':
+        description_queue.submit(current_user['_id'], inserted_id, image_ids)
     
     return jsonify({
-        'id': str(result.inserted_id),
+        'id': str(inserted_id),
         'name': item['name'],
         'fit_description': item['fit_description'],
-        'images': item['images'],
+        'images': doc_image_urls(item, 'image_ids', 'images', current_user['_id']),
+        'thumbnails': doc_rendition_urls(item, 'image_ids', 'thumb', current_user['_id']),
         'category': item['category'],
         'tag': item['tag'],
         'color': item['color'],
         'in_laundry': item['in_laundry'],
         'unavailable': item['unavailable'],
+        'ai_description_status': item['ai_description_status'],
         'created_at': item['created_at']
     }), 201
 
@@ -693,16 +639,14 @@ def add_wardrobe_item(current_user):
 @token_required
 def update_wardrobe_item(current_user, item_id):
     # Find the item
-    item = wardrobe_items.find_one({
-        '_id': ObjectId(item_id), 
-        'user_id': str(current_user['_id'])
-    })
+    item = repository.get_wardrobe_item(current_user['_id'], item_id)
     
     if not item:
         return jsonify({'error': 'Item not found'}), 404
     
     data = {}
-    image_data_list = []
+    image_ids = []
+    keep_images = False
     
     # Check if this is a multipart form or JSON
     if request.content_type and 'multipart/form-data' in request.content_type:
@@ -721,26 +665,17 @@ def update_wardrobe_item(current_user, item_id):
             for image_file in image_files:
                 if image_file.filename != '':
                     if allowed_file(image_file.filename):
-                        # Save file temporarily
-                        filename = secure_filename(image_file.filename)
-                        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                        image_file.save(filepath)
-                        
-                        # Convert to base64
-                        with open(filepath, "rb") as f:
-                            img_data = base64.b64encode(f.read()).decode('utf-8')
-                        
-                        # Add to image data list
-                        image_data_list.append(f"data:image/jpeg;base64,{img_data}")
-                        
-                        # Clean up temporary file
-                        os.remove(filepath)
+                        # Downscale, re-encode and store the image
+                        try:
+                            image_ids.append(store_upload(image_file, current_user['_id'], 'fashn'))
+                        except ValueError as e:
+                            return jsonify({'error': str(e)}), 400
                     else:
                         return jsonify({'error': 'Only image files (png, jpg, jpeg) are allowed'}), 400
         
         # If no new images were uploaded, keep the existing ones
-        if not image_data_list and 'images' in item:
-            image_data_list = item['images']
+        if not image_ids:
+            keep_images = True
     else:
         # Handle JSON data
         data = request.get_json()
@@ -749,43 +684,49 @@ def update_wardrobe_item(current_user, item_id):
         
         # If there's base64 image data in the JSON
         if 'images' in data and isinstance(data['images'], list):
-            image_data_list = data['images']
-        elif 'images' in item:
-            image_data_list = item['images']
+            try:
+                image_ids = [store_image_value(img, current_user['_id'], 'fashn') for img in data['images']]
+            except (ValueError, TypeError) as e:
+                return jsonify({'error': str(e)}), 400
+        else:
+            keep_images = True
     
     # Validate required fields
     if not data.get('tag'):
         return jsonify({'error': 'Clothing tag is required'}), 400
     
-    if not image_data_list:
-        return jsonify({'error': 'At least one image is required'}), 400
-    
-    if len(image_data_list) > 5:
-        return jsonify({'error': 'Maximum 5 images allowed'}), 400
-    
     # Get category based on tag
     category = get_category_for_tag(data['tag'])
     if not category:
         return jsonify({'error': 'Invalid clothing tag'}), 400
     
-    # Generate AI description of the garment if images have changed
-    images_changed = ('images' not in item) or (set(image_data_list) != set(item['images']))
+    if keep_images:
+        if 'image_ids' in item:
+            image_ids = item['image_ids']
+        else:
+            # Saved before the blob store, with inline images; move them over
+            # now that the rest of the request is valid
+            try:
+                image_ids = [store_image_value(img, current_user['_id'], 'fashn') for img in item.get('images', [])]
+            except (ValueError, TypeError) as e:
+                return jsonify({'error': f"Could not read the item's current images, please upload new ones: {e}"}), 400
     
-    ai_description = item.get('ai_description', '')
-    if images_changed:
-        try:
-            ai_description = describe_garment([img.split(',')[1] if ',' in img else img for img in image_data_list])
-        except Exception as e:
-            print(f"Error generating AI description: {e}")
-            if not ai_description:
-                ai_description = "Description could not be generated."
+    if not image_ids:
+        return jsonify({'error': 'At least one image is required'}), 400
+    
+    if len(image_ids) > 5:
+        return jsonify({'error': 'Maximum 5 images allowed'}), 400
+    
+    # Describe the garment again in the background if its images have changed;
+    # the old description is kept until the new one is ready
+    images_changed = not keep_images and set(image_ids) != set(item.get('image_ids', []))
     
     # Update the item
     update_data = {
         'name': data.get('name', item.get('name', '')),
         'fit_description': data.get('fit_description', item.get('fit_description', '')),
-        'images': image_data_list,
-        'ai_description': ai_description,
+        'image_ids': image_ids,
+        **(description_fields(image_ids) if images_changed else {}),
         'category': category,
         'tag': data['tag'],
         'color': data.get('color', item.get('color', '')),
@@ -794,25 +735,27 @@ def update_wardrobe_item(current_user, item_id):
         'updated_at': time.time()
     }
     
-    # Update in database
-    wardrobe_items.update_one(
-        {'_id': ObjectId(item_id)},
-        {'$set': update_data}
-    )
+    # Update in database, getting the updated item back from the same call
+    updated_item = repository.update_wardrobe_item(current_user['_id'], item_id, update_data, unset=['images'])
     
-    # Get the updated item
-    updated_item = wardrobe_items.find_one({'_id': ObjectId(item_id)})
+    if not updated_item:
+        return jsonify({'error': 'Item not found'}), 404
+    
+    if update_data.get('ai_description_status') == 'pending':
+        description_queue.submit(current_user['_id'], item_id, image_ids)
     
     return jsonify({
         'id': str(updated_item['_id']),
         'name': updated_item.get('name', ''),
         'fit_description': updated_item.get('fit_description', ''),
-        'images': updated_item.get('images', []),
+        'images': doc_image_urls(updated_item, 'image_ids', 'images', current_user['_id']),
+        'thumbnails': doc_rendition_urls(updated_item, 'image_ids', 'thumb', current_user['_id']),
         'category': updated_item['category'],
         'tag': updated_item['tag'],
         'color': updated_item.get('color', ''),
         'in_laundry': updated_item.get('in_laundry', False),
         'unavailable': updated_item.get('unavailable', False),
+        'ai_description_status': updated_item.get('ai_description_status', 'ready'),
         'created_at': updated_item['created_at'],
         'updated_at': updated_item.get('updated_at', '')
     }), 200
@@ -820,18 +763,10 @@ def update_wardrobe_item(current_user, item_id):
 @app.route('/api/wardrobe/<item_id>', methods=['DELETE'])
 @token_required
 def delete_wardrobe_item(current_user, item_id):
-    # Find the item
-    item = wardrobe_items.find_one({
-        '_id': ObjectId(item_id), 
-        'user_id': str(current_user['_id'])
-    })
-    
-    if not item:
+    # Delete the item if it is the user's
+    if not repository.delete_wardrobe_item(current_user['_id'], item_id):
         return jsonify({'error': 'Item not found'}), 404
     
-    # Delete the item
-    wardrobe_items.delete_one({'_id': ObjectId(item_id)})
-    
     return jsonify({'message': 'Item deleted successfully'}), 200
 
 @app.route('/api/wardrobe/toggle/<item_id>', methods=['PATCH'])
@@ -841,15 +776,6 @@ def toggle_wardrobe_item_status(current_user, item_id):
     if not data:
         return jsonify({'error': 'No data provided'}), 400
     
-    # Find the item
-    item = wardrobe_items.find_one({
-        '_id': ObjectId(item_id), 
-        'user_id': str(current_user['_id'])
-    })
-    
-    if not item:
-        return jsonify({'error': 'Item not found'}), 404
-    
     # Update status fields
     update_data = {}
     
@@ -864,14 +790,13 @@ def toggle_wardrobe_item_status(current_user, item_id):
     
     update_data['updated_at'] = time.time()
     
-    # Update in database
-    wardrobe_items.update_one(
-        {'_id': ObjectId(item_id)},
-        {'$set': update_data}
+    # Update in database, getting the updated item back from the same call
+    updated_item = repository.update_wardrobe_item(
+        current_user['_id'], item_id, update_data, projection=repository.WARDROBE_STATUS_FIELDS
     )
     
-    # Get the updated item
-    updated_item = wardrobe_items.find_one({'_id': ObjectId(item_id)})
+    if not updated_item:
+        return jsonify({'error': 'Item not found'}), 404
     
     return jsonify({
         'id': str(updated_item['_id']),
@@ -880,6 +805,67 @@ def toggle_wardrobe_item_status(current_user, item_id):
         'updated_at': updated_item.get('updated_at', '')
     }), 200
 
+# Stored images
+def image_link_error(image_id):
+    # Links are signed for one of the image's owners and expire; see blob_store
+    user_id = verify_image_link(image_id, request.args)
+    if user_id is None:
+        return jsonify({'error': 'Image link is invalid or has expired'}), 403
+    if not owns_blob(image_id, user_id):
+        return jsonify({'error': 'Image not found'}), 404
+    return None
+
+@app.route('/api/images/<image_id>', methods=['GET'])
+def get_image(image_id):
+    # <img> tags cannot send an Authorization header, so the signed link is
+    # the credential. The content under an id never changes, so a client
+    # holding any copy of it already has the right one.
+    error = image_link_error(image_id)
+    if error:
+        return error
+
+    if request.if_none_match.contains(image_id):
+        return not_modified(image_id, IMMUTABLE)
+
+    blob = get_blob(image_id)
+
+    if not blob:
+        return jsonify({'error': 'Image not found'}), 404
+
+    data, content_type = blob
+    return immutable_response(Response(data, mimetype=content_type), image_id)
+
+@app.route('/api/images/<image_id>/<size>', methods=['GET'])
+def get_image_rendition(image_id, size):
+    if size not in SIZES:
+        return jsonify({'error': 'Unknown image size'}), 404
+
+    # Renditions are served to the owners of the original
+    error = image_link_error(image_id)
+    if error:
+        return error
+
+    rendition_id = get_rendition(image_id, size)
+    if rendition_id and request.if_none_match.contains(rendition_id):
+        return not_modified(rendition_id, IMMUTABLE)
+
+    blob = get_blob(rendition_id) if rendition_id else None
+    if blob:
+        data, content_type = blob
+        return immutable_response(Response(data, mimetype=content_type), rendition_id)
+
+    # Not rendered yet (or stored before renditions existed); serve the original
+    # meanwhile, without letting it be cached in place of the rendition
+    blob = get_blob(image_id)
+    if not blob:
+        return jsonify({'error': 'Image not found'}), 404
+    schedule_renditions(image_id)
+
+    data, content_type = blob
+    response = Response(data, mimetype=content_type)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 # Alternatives API
 @app.route('/api/alternatives', methods=['POST'])
 def get_alternatives():
@@ -912,25 +898,21 @@ def get_weather(current_user):
     lat = request.args.get('lat')
     lon = request.args.get('lon')
     
-    if not lat or not lon:
-        return jsonify({'error': 'Latitude and longitude are required'}), 400
-    
     try:
-        # Make API request to weather service (OpenWeatherMap in this example)
-        response = requests.get(
-            f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={WEATHER_API_KEY}&units=metric",
-            timeout=10
-        )
-        # print(response.status_code)
-        if response.status_code != 200:
-            return jsonify({
-                'error': f'Weather API request failed with status code {response.status_code}',
-                'details': response.text
-            }), 500
+        if not lat or not lon:
+            # No coordinates (e.g. geolocation denied): locate the client by IP
+            _, lat, lon = weather_service.locate(request.remote_addr)
+        
+        # Where outfits are precomputed for this user
+        repository.record_location(current_user['_id'], *grid_cell(lat, lon))
         
-        # Return the weather data
-        return jsonify(response.json()), 200
+        # Nearby users share one cached OpenWeatherMap response per grid cell
+        return jsonify(weather_service.current(lat, lon)), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except WeatherUnavailable as e:
+        return jsonify({'error': str(e), 'details': e.details}), 502
     except Exception as e:
         return jsonify({'error': f'Weather API request failed: {str(e)}'}), 500
 
@@ -954,67 +936,72 @@ def suggest_outfit(current_user):
     ]
 
     if image_base64:
+        try:
+            image_url = normalize_data_uri(image_base64, 'openai')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
         messages[0]["content"].append({
             "type": "image_url",
             "image_url": {
-                "url": f"data:image/jpeg;base64,{image_base64}",
+                "url": image_url,
                 "detail": "high"
             }
         })
 
-    from openai import OpenAI
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    if not wants_event_stream():
+        response = openai_api.call(
+            get_openai_client().chat.completions.create,
+            model="gpt-4o",
+            messages=messages,
+            max_tokens=300
+        )
+
+        return jsonify({"recommendation": response.choices[0].message.content})
+
+    # Server-sent events: 'delta' events with text as it is generated, then 'done'
+    def events():
+        recommendation = ''
+        try:
+            with openai_api.stream(
+                get_openai_client().chat.completions.create,
+                model="gpt-4o",
+                messages=messages,
+                max_tokens=300,
+                stream=True
+            ) as stream:
+                for chunk in stream:
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    if text:
+                        recommendation += text
+                        yield sse_event('delta', {'text': text})
+            yield sse_event('done', {'recommendation': recommendation})
+        except Exception as e:
+            print(f"Error streaming outfit recommendation: {e}")
+            yield sse_event('error', {'error': 'Could not generate an outfit recommendation'})
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        max_tokens=300
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
     )
 
-    return jsonify({"recommendation": response.choices[0].message.content})
 
+OUTFIT_MODES = ('llm', 'local')
+# Seconds the model gets before the local outfit engine answers instead
+OUTFIT_LLM_BUDGET = float(os.environ.get('OUTFIT_LLM_BUDGET', '8'))
 
-@app.route('/api/outfit-suggestions', methods=['POST'])
-@token_required
-def get_outfit_suggestions(current_user):
-    # Get request data
-    data = request.get_json()
-    
-    if not data or not data.get('occasion'):
-        return jsonify({'error': 'Occasion is required'}), 400
-    
-    # Get available wardrobe items (not in laundry or unavailable)
-    available_items = list(wardrobe_items.find({
-        'user_id': str(current_user['_id']),
-        'in_laundry': False,
-        'unavailable': False
-    }))
-    
-    if not available_items:
-        return jsonify({'error': 'No available items in your wardrobe'}), 400
-    
-    # Format the items for the API
-    formatted_items = []
-    for item in available_items:
-        formatted_item = {
-            'id': str(item['_id']),
-            'name': item.get('name', ''),
-            'category': item['category'],
-            'tag': item['tag']
-        }
-        
-        # Add AI description if available
-        if 'ai_description' in item and item['ai_description']:
-            formatted_item['ai_description'] = item['ai_description']
-        
-        # Add fit description if available
-        if 'fit_description' in item and item['fit_description']:
-            formatted_item['fit_description'] = item['fit_description']
-        
-        formatted_items.append(formatted_item)
+class OutfitBudgetExceeded(TimeoutError):
+    """The model had not finished its outfits when the latency budget ran out"""
+
+def outfit_prompt(available_items, occasion, weather_data):
+    """Prompt asking the model for 3 outfits from a shortlist of the available items"""
+    # Only a category-balanced shortlist of the best-suited items goes to the model
+    candidates = shortlist(available_items, occasion, weather_data)
+    items_text = compact_items(candidates)
     
     # Extract weather information
-    weather_data = data.get('weatherData', {})
+    weather_data = weather_data or {}
     weather_description = "Unknown"
     temperature = "Unknown"
     
@@ -1031,12 +1018,12 @@ def get_outfit_suggestions(current_user):
     prompt = f"""
     You are a personal stylist helping someone choose 3 outfits from their wardrobe.
 
-    OCCASION: {data['occasion']}
+    OCCASION: {occasion}
     
     WEATHER: {weather_info}
     
-    AVAILABLE ITEMS:
-    {json.dumps(formatted_items, indent=2)}
+    AVAILABLE ITEMS (desc = description, fit = fit notes):
+    {items_text}
     
     Based on the occasion and weather, suggest 3 complete outfits using only the available items. For each outfit, provide styling tips.
     
@@ -1055,46 +1042,256 @@ def get_outfit_suggestions(current_user):
     Ensure each outfit is complete and appropriate for the occasion and weather. Only include items that are in the available items list.
     """
     
-    try:
-        # Call OpenAI API
-        response = openai.responses.create(
-            model="gpt-4.1-mini",
-            input=[{"role": "user", "content": prompt}],
-            temperature=0.7
-        )
-        
-        # Extract and parse the response
-        content = response.output_text
-        
-        # Sometimes the API returns markdown-formatted JSON, so we need to clean it up
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            content = content.split("```")[1].split("```")[0].strip()
-        
-        suggestions = json.loads(content)
-        
-        for outfit in suggestions.get('outfits', []):
-            for item in outfit.get('items', []):
-                if 'id' in item:
-                    # Find the original item
-                    original_item = next((i for i in available_items if str(i['_id']) == item['id']), None)
-                    if original_item:
-                        # Add image URLs
-                        if 'images' in original_item and original_item['images']:
-                            item['images'] = original_item['images']
-                        # Add name if available
-                        if 'name' in original_item and original_item['name']:
-                            item['name'] = original_item['name']
-                        # Add tag
-                        if 'tag' in original_item:
-                            item['tag'] = original_item['tag']
-
-        return jsonify(suggestions), 200
+    # Size of the list before pre-ranking, estimated (~4 chars per token) to keep it cheap
+    after_tokens = count_tokens(items_text)
+    before_tokens = len(compact_items(available_items)) // 4 if len(candidates) < len(available_items) else after_tokens
+    print(
+        f"Outfit prompt: {len(candidates)} of {len(available_items)} items, item list "
+        f"~{before_tokens} -> {after_tokens} tokens, prompt {count_tokens(prompt)} tokens"
+    )
     
-    except Exception as e:
-        print(f"Error generating outfit suggestions: {e}")
-        return jsonify({'error': 'Failed to generate outfit suggestions'}), 500
+    return prompt
+
+def stream_llm_outfits(available_items, occasion, weather_data, budget=OUTFIT_LLM_BUDGET):
+    """
+    Yield the model's outfits one by one as each completes in the token stream.
+    Raises on upstream errors, on replies that hold no outfits and once the
+    latency budget (OUTFIT_LLM_BUDGET for requests) is spent.
+    """
+    deadline = time.time() + budget
+    prompt = outfit_prompt(available_items, occasion, weather_data)
+    
+    def create(**kwargs):
+        # Whatever waiting for a slot left of the budget; SDK retries would overrun it
+        remaining = max(deadline - time.time(), 0.1)
+        return get_openai_client().with_options(timeout=remaining, max_retries=0).responses.create(**kwargs)
+    
+    # Markdown code fences around the JSON are skipped by the parser
+    parser = ArrayItemStream('outfits')
+    count = 0
+    
+    # Call OpenAI API, waiting for a free slot no longer than the budget allows
+    with openai_api.stream(
+        create,
+        acquire_timeout=max(deadline - time.time(), 0),
+        # Giving up on a slow answer is our deadline, not an upstream failure
+        caller_errors=(OutfitBudgetExceeded,),
+        model="gpt-4.1-mini",
+        input=[{"role": "user", "content": prompt}],
+        temperature=0.7,
+        stream=True
+    ) as stream:
+        for event in stream:
+            if event.type == 'response.output_text.delta':
+                for outfit in parser.feed(event.delta):
+                    count += 1
+                    yield outfit
+            if parser.done:
+                break
+            if time.time() > deadline:
+                raise OutfitBudgetExceeded(f'No complete answer within {budget}s')
+    
+    if not count:
+        raise ValueError('The model returned no outfits')
+
+def llm_outfit_suggestions(available_items, occasion, weather_data):
+    """All of the model's outfits at once"""
+    return {'outfits': list(stream_llm_outfits(available_items, occasion, weather_data))}
+
+def hydrate_outfits(user_id, suggestions, available_items):
+    """Add names, tags and image URLs of the chosen items to suggestions, in place"""
+    # Look chosen items up by id; only they are hydrated, whatever the wardrobe size
+    items_by_id = {str(item['_id']): item for item in available_items}
+    chosen = {
+        items_by_id[item['id']]['_id']: items_by_id[item['id']]
+        for outfit in suggestions.get('outfits', [])
+        for item in outfit.get('items', [])
+        if item.get('id') in items_by_id
+    }
+    # Items saved before the blob store only have inline images; read (never
+    # convert) those of the chosen ones, and leave moving them to migrate_images.py
+    legacy_ids = [item_id for item_id, item in chosen.items() if 'image_ids' not in item]
+    legacy = {
+        str(item['_id']): item
+        for item in (repository.find_wardrobe_items(user_id, legacy_ids, {'images': 1}) if legacy_ids else [])
+    }
+    
+    for outfit in suggestions.get('outfits', []):
+        for item in outfit.get('items', []):
+            original_item = items_by_id.get(item.get('id'))
+            if original_item:
+                # Add image URLs, or inline images for items not yet migrated
+                if item['id'] in legacy:
+                    item_images = doc_image_urls(legacy[item['id']], 'image_ids', 'images', user_id)
+                else:
+                    item_images = doc_rendition_urls(original_item, 'image_ids', 'medium', user_id)
+                if item_images:
+                    item['images'] = item_images
+                # Add name if available
+                if original_item.get('name'):
+                    item['name'] = original_item['name']
+                # Add tag
+                if 'tag' in original_item:
+                    item['tag'] = original_item['tag']
+
+def outfit_signature(outfit):
+    return frozenset(item.get('id') for item in outfit.get('items', []))
+
+def generate_outfits(user_id, available_items, occasion, weather_data, mode):
+    """
+    Yield ('outfit', outfit) for each hydrated outfit as soon as it is ready, then
+    ('done', details). In 'llm' mode, a failed or slow model is made up for
+    with local outfits, up to the usual three.
+    """
+    produced = []
+    fallback = False
+    
+    if mode == 'llm':
+        try:
+            for outfit in stream_llm_outfits(available_items, occasion, weather_data):
+                hydrate_outfits(user_id, {'outfits': [outfit]}, available_items)
+                produced.append(outfit)
+                yield 'outfit', outfit
+        except Exception as e:
+            print(f"Error generating outfit suggestions, using local outfits instead: {e}")
+            fallback = True
+    
+    if mode == 'local' or fallback:
+        from_model = len(produced)
+        seen = {outfit_signature(outfit) for outfit in produced}
+        for outfit in suggest_outfits(available_items, occasion, weather_data)['outfits']:
+            if len(produced) >= OUTFIT_COUNT:
+                break
+            if outfit_signature(outfit) in seen:
+                continue
+            hydrate_outfits(user_id, {'outfits': [outfit]}, available_items)
+            produced.append(outfit)
+            yield 'outfit', outfit
+        source = 'llm' if not fallback else ('mixed' if from_model else 'local')
+    else:
+        source = 'llm'
+    
+    details = {'source': source}
+    if fallback:
+        # Not cached, so the model is asked again next time
+        details['fallback'] = True
+    yield 'done', details
+
+def generate_and_cache_outfits(user_id, available_items, occasion, weather_data, mode, cache_key):
+    """generate_outfits, caching the complete answer unless it had to fall back to local outfits"""
+    suggestions = {'outfits': []}
+    for kind, value in generate_outfits(user_id, available_items, occasion, weather_data, mode):
+        if kind == 'outfit':
+            suggestions['outfits'].append(value)
+        else:
+            suggestions.update(value)
+        yield kind, value
+    if not suggestions.get('fallback'):
+        suggestion_cache.put(cache_key, user_id, suggestions)
+
+def precompute_outfit_suggestions(user_id, occasion, weather_data):
+    """
+    Cache the model's suggestions ahead of a request; False if already cached
+    or impossible. Nobody is waiting, so the model gets PRECOMPUTE_LLM_BUDGET
+    and there is no local fallback: a failed or slow answer raises.
+    """
+    available_items = repository.available_wardrobe(user_id)
+    if not available_items:
+        return False
+    
+    cache_key = suggestion_key([item['_id'] for item in available_items], occasion, weather_data, 'llm')
+    if suggestion_cache.contains(cache_key):
+        return False
+    
+    suggestions = {'outfits': list(stream_llm_outfits(available_items, occasion, weather_data, PRECOMPUTE_LLM_BUDGET))}
+    hydrate_outfits(user_id, suggestions, available_items)
+    suggestions['source'] = 'llm'
+    suggestion_cache.put(cache_key, user_id, suggestions)
+    return True
+
+outfit_precomputer = OutfitPrecomputer(precompute_outfit_suggestions)
+if PRECOMPUTE_ENABLED and IS_APP_PROCESS:
+    outfit_precomputer.start()
+
+@app.route('/api/outfit-suggestions', methods=['POST'])
+@token_required
+def get_outfit_suggestions(current_user):
+    # Get request data
+    data = request.get_json()
+    
+    if not data or not data.get('occasion'):
+        return jsonify({'error': 'Occasion is required'}), 400
+    
+    # 'llm' asks the model (falling back to the local engine); 'local' never does
+    mode = data.get('mode', 'llm')
+    if mode not in OUTFIT_MODES:
+        return jsonify({'error': f"mode must be one of {', '.join(OUTFIT_MODES)}"}), 400
+    
+    # Get available wardrobe items (not in laundry or unavailable)
+    available_items = repository.available_wardrobe(current_user['_id'])
+    
+    if not available_items:
+        return jsonify({'error': 'No available items in your wardrobe'}), 400
+    
+    # Same clean clothes, same occasion, much the same weather: reuse the last answer
+    user_id = current_user['_id']
+    occasion, weather_data = data['occasion'], data.get('weatherData')
+    repository.record_occasion(user_id, str(occasion).strip()[:200])
+    cache_key = suggestion_key([item['_id'] for item in available_items], occasion, weather_data, mode)
+    cached = suggestion_cache.get(cache_key)
+    
+    def replay():
+        for outfit in cached['outfits']:
+            yield 'outfit', outfit
+        yield 'done', {key: value for key, value in cached.items() if key != 'outfits'} | {'cached': True}
+    
+    if cached:
+        results = replay()
+    else:
+        results = generate_and_cache_outfits(user_id, available_items, occasion, weather_data, mode, cache_key)
+    
+    if not wants_event_stream():
+        try:
+            results = list(results)
+        except Exception as e:
+            print(f"Error preparing outfit suggestions: {e}")
+            return jsonify({'error': 'Failed to generate outfit suggestions'}), 500
+        return jsonify({'outfits': [value for kind, value in results if kind == 'outfit'], **results[-1][1]}), 200
+    
+    # Server-sent events: an 'outfit' event per outfit as soon as it is ready, then 'done'
+    def events():
+        try:
+            for kind, value in results:
+                yield sse_event(kind, value)
+        except Exception as e:
+            print(f"Error streaming outfit suggestions: {e}")
+            yield sse_event('error', {'error': 'Failed to generate outfit suggestions'})
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+# Operational metrics
+@app.route('/api/metrics', methods=['GET'])
+@token_required
+def get_metrics(current_user):
+    return jsonify({
+        'upstreams': upstream_stats(),
+        'try_on_polling': job_manager.stats(),
+        'try_on_cache': result_cache.stats(),
+        'outfit_cache': suggestion_cache.stats(),
+        'image_normalization': image_stats.snapshot(),
+        'mongo': command_timer.snapshot(),
+        'user_cache': user_cache.stats(),
+        'password_hashing': password_hasher.stats(),
+        'weather': weather_service.stats(),
+        'outfit_precompute': outfit_precomputer.stats(),
+        'descriptions': description_queue.stats(),
+        'description_cache': garment_description_cache.stats()
+    }), 200
 
 
 # Serve React frontend in production
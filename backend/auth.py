@@ -1,15 +1,99 @@
+import os
 import jwt
+import time
 import datetime
+import threading
+from collections import OrderedDict
 from functools import wraps
 from flask import request, jsonify, current_app
-from flask_bcrypt import Bcrypt
 from db import users
 from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+import repository
+from password_hashing import password_hasher
 
-bcrypt = Bcrypt()
+# Recently authenticated users, so most requests skip the users lookup. Nothing
+# writes a user's email or name after registration, so entries are only ever
+# dropped by age: a deleted user keeps access for at most USER_CACHE_TTL.
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '1000'))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '60'))
 
-def generate_token(user_id):
-    """Generate a JWT token for a user"""
+# Optionally trust the email/name signed into a token for a short while after
+# it was issued, skipping the lookup entirely. A deleted user keeps access
+# for at most this long.
+TRUST_TOKEN_CLAIMS = os.environ.get('TRUST_TOKEN_CLAIMS', 'false').lower() == 'true'
+TRUSTED_CLAIMS_MAX_AGE = int(os.environ.get('TRUSTED_CLAIMS_MAX_AGE', '900'))
+
+
+class UserCache:
+    """Bounded LRU of user projections, each kept for at most `ttl` seconds"""
+
+    def __init__(self, max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.trusted = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return dict(entry[1])
+            if entry:
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, user_id, user):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, dict(user))
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def record_trusted(self):
+        with self._lock:
+            self.trusted += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'trusted_claims': self.trusted
+            }
+
+
+user_cache = UserCache()
+
+
+def load_current_user(data):
+    """The user a decoded token belongs to, or None if they no longer exist"""
+    user_id = data['sub']
+
+    if TRUST_TOKEN_CLAIMS and 'email' in data and time.time() - data.get('iat', 0) < TRUSTED_CLAIMS_MAX_AGE:
+        user_cache.record_trusted()
+        return {'_id': ObjectId(user_id), 'email': data['email'], 'name': data.get('name', '')}
+
+    user = user_cache.get(user_id)
+    if user is None:
+        user = repository.get_user(user_id)
+        if user:
+            user_cache.put(user_id, user)
+    return user
+
+
+def generate_token(user_id, user=None):
+    """Generate a JWT token for a user, signing in their email and name if given"""
     try:
         # Token payload
         payload = {
@@ -17,6 +101,9 @@ def generate_token(user_id):
             'iat': datetime.datetime.utcnow(),
             'sub': str(user_id)
         }
+        if user:
+            payload['email'] = user['email']
+            payload['name'] = user['name']
         
         # Create token
         token = jwt.encode(
@@ -56,7 +143,7 @@ def token_required(f):
             )
             
             # Get current user from token data
-            current_user = users.find_one({'_id': ObjectId(data['sub'])})
+            current_user = load_current_user(data)
             
             if not current_user:
                 return jsonify({'error': 'User not found'}), 401
@@ -76,13 +163,13 @@ def token_required(f):
     return decorated
 
 def register_user(email, password, name):
-    """Register a new user"""
+    """Register a new user. Raises PasswordHashingBusy when hashing is saturated."""
     # Check if user already exists
     if users.find_one({'email': email}):
         return None, "Email already registered"
     
     # Hash the password
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+    hashed_password = password_hasher.hash(password)
     
     # Create user object
     new_user = {
@@ -93,14 +180,17 @@ def register_user(email, password, name):
         'try_on_history': []
     }
     
-    # Insert into database
-    result = users.insert_one(new_user)
+    # Insert into database; the unique email index settles concurrent sign-ups
+    try:
+        result = users.insert_one(new_user)
+    except DuplicateKeyError:
+        return None, "Email already registered"
     
     # Return the user ID
     return str(result.inserted_id), None
 
 def authenticate_user(email, password):
-    """Authenticate a user by email and password"""
+    """Authenticate a user by email and password. Raises PasswordHashingBusy when hashing is saturated."""
     # Find the user
     user = users.find_one({'email': email})
     
@@ -108,7 +198,7 @@ def authenticate_user(email, password):
         return None, "Email not found"
     
     # Check password
-    if bcrypt.check_password_hash(user['password'], password):
+    if password_hasher.check(user['password'], password):
         return user, None
     
     return None, "Invalid password"
\ No newline at end of file
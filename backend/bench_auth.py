@@ -0,0 +1,109 @@
+"""
+Login storm benchmark.
+
+Measures the latency of an unrelated endpoint (GET /api/wardrobe) on its
+own, then again while many clients log in at once, and reports login
+throughput and rejections. Run against a live backend:
+
+    python bench_auth.py [--base-url http://localhost:5001] [--concurrency 32] [--duration 20]
+
+A bench user is registered on first run and reused afterwards.
+"""
+import time
+import argparse
+import threading
+
+import requests
+
+BENCH_EMAIL = 'bench-login@example.com'
+BENCH_PASSWORD = 'bench-login-password'
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def login(session, base_url):
+    return session.post(f"{base_url}/api/login", json={'email': BENCH_EMAIL, 'password': BENCH_PASSWORD}, timeout=60)
+
+
+def get_token(base_url):
+    session = requests.Session()
+    response = login(session, base_url)
+    if response.status_code == 401:
+        response = session.post(f"{base_url}/api/register", json={
+            'email': BENCH_EMAIL, 'password': BENCH_PASSWORD, 'name': 'Bench'
+        }, timeout=60)
+    response.raise_for_status()
+    return response.json()['token']
+
+
+def probe(base_url, token, stop, latencies, interval=0.05):
+    """Poll the wardrobe endpoint until stopped, recording latencies in ms"""
+    session = requests.Session()
+    headers = {'Authorization': f'Bearer {token}'}
+    while not stop.is_set():
+        started = time.perf_counter()
+        session.get(f"{base_url}/api/wardrobe", headers=headers, timeout=60)
+        latencies.append((time.perf_counter() - started) * 1000)
+        time.sleep(interval)
+
+
+def storm(base_url, stop, results):
+    session = requests.Session()
+    while not stop.is_set():
+        started = time.perf_counter()
+        status = login(session, base_url).status_code
+        results.append((status, (time.perf_counter() - started) * 1000))
+
+
+def run_phase(base_url, token, duration, concurrency):
+    stop = threading.Event()
+    probe_latencies, logins = [], []
+    threads = [threading.Thread(target=probe, args=(base_url, token, stop, probe_latencies))]
+    threads += [threading.Thread(target=storm, args=(base_url, stop, logins)) for _ in range(concurrency)]
+
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return probe_latencies, logins
+
+
+def report(label, duration, probe_latencies, logins):
+    print(f"\n{label}")
+    print(f"  wardrobe  requests={len(probe_latencies)} "
+          f"p50={percentile(probe_latencies, 0.5) or 0:.1f}ms p95={percentile(probe_latencies, 0.95) or 0:.1f}ms")
+    if logins:
+        ok = [latency for status, latency in logins if status == 200]
+        rejected = sum(1 for status, _ in logins if status == 503)
+        print(f"  logins    ok={len(ok)} ({len(ok) / duration:.1f}/s) rejected={rejected} "
+              f"p50={percentile(ok, 0.5) or 0:.1f}ms p95={percentile(ok, 0.95) or 0:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Login storm benchmark")
+    parser.add_argument('--base-url', default='http://localhost:5001')
+    parser.add_argument('--concurrency', type=int, default=32, help="Concurrent login clients")
+    parser.add_argument('--duration', type=float, default=20, help="Seconds per phase")
+    args = parser.parse_args()
+
+    token = get_token(args.base_url)
+
+    report("Baseline (no logins)", args.duration, *run_phase(args.base_url, token, args.duration, 0))
+    report(f"Login storm ({args.concurrency} clients)", args.duration,
+           *run_phase(args.base_url, token, args.duration, args.concurrency))
+
+    metrics = requests.get(f"{args.base_url}/api/metrics", headers={'Authorization': f'Bearer {token}'}, timeout=10)
+    if metrics.ok:
+        print(f"\nServer password hashing: {metrics.json().get('password_hashing')}")
+
+
+if __name__ == "__main__":
+    main()
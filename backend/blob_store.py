@@ -0,0 +1,246 @@
+"""
+Content-addressed image storage.
+
+Image bytes are stored once under the SHA-256 of their content and documents
+keep only that id. The default backend is GridFS in the app database; set
+BLOB_STORE=filesystem to keep blobs in a local directory instead. Blobs are
+served by /api/images/<image_id>.
+
+Each blob records the users who stored it, and only they are given links to
+it. Image URLs carry an HMAC signature of the image id, the user and an
+expiry, so <img> tags can load them without an Authorization header; a link
+stays valid for at least IMAGE_URL_TTL seconds and is the same for everyone
+asking within one IMAGE_URL_TTL window.
+"""
+import os
+import re
+import hmac
+import json
+import time
+import base64
+import hashlib
+import tempfile
+from urllib.parse import urlencode
+
+from db import db, blob_owners
+
+BLOB_STORE = os.getenv('BLOB_STORE', 'gridfs')
+BLOB_STORE_PATH = os.getenv('BLOB_STORE_PATH', 'blobs')
+IMAGE_URL_PREFIX = '/api/images/'
+IMAGE_URL_TTL = int(os.getenv('IMAGE_URL_TTL', str(24 * 3600)))
+IMAGE_URL_SECRET = (os.getenv('IMAGE_URL_SECRET') or os.getenv('SECRET_KEY', 'dev-key-for-development-only')).encode('utf-8')
+
+_IMAGE_ID = re.compile(r'^[0-9a-f]{64}$')
+
+
+class GridFSBlobBackend:
+    def __init__(self, database, bucket_name='images'):
+        import gridfs
+
+        self._gridfs = gridfs
+        self.bucket = gridfs.GridFSBucket(database, bucket_name=bucket_name)
+        self.files = database[f'{bucket_name}.files']
+
+    def exists(self, blob_id):
+        return self.files.find_one({'_id': blob_id}, {'_id': 1}) is not None
+
+    def put(self, blob_id, data, content_type):
+        try:
+            self.bucket.upload_from_stream_with_id(
+                blob_id, blob_id, data,
+                metadata={'contentType': content_type}
+            )
+        except self._gridfs.errors.FileExists:
+            # Someone stored the same content first
+            pass
+
+    def get(self, blob_id):
+        try:
+            stream = self.bucket.open_download_stream(blob_id)
+        except self._gridfs.errors.NoFile:
+            return None
+        return stream.read(), (stream.metadata or {}).get('contentType', 'application/octet-stream')
+
+
+class FileSystemBlobBackend:
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, blob_id):
+        return os.path.join(self.root, blob_id[:2], blob_id)
+
+    def exists(self, blob_id):
+        return os.path.exists(self._path(blob_id))
+
+    def put(self, blob_id, data, content_type):
+        path = self._path(blob_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write the metadata first and the blob last, each via an atomic rename
+        self._write_atomic(path + '.json', json.dumps({'contentType': content_type}).encode('utf-8'))
+        self._write_atomic(path, data)
+
+    def get(self, blob_id):
+        path = self._path(blob_id)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            with open(path + '.json', 'rb') as f:
+                metadata = json.load(f)
+        except FileNotFoundError:
+            return None
+        return data, metadata.get('contentType', 'application/octet-stream')
+
+    def _write_atomic(self, path, data):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+
+def _create_backend():
+    if BLOB_STORE == 'filesystem':
+        return FileSystemBlobBackend(BLOB_STORE_PATH)
+    return GridFSBlobBackend(db)
+
+
+backend = _create_backend()
+
+
+def put_blob(data, content_type=None, owner=None):
+    """Store bytes (once) and return their content id, recording `owner` as one of its owners"""
+    blob_id = hashlib.sha256(data).hexdigest()
+    if not backend.exists(blob_id):
+        backend.put(blob_id, data, content_type or sniff_content_type(data))
+    if owner is not None:
+        grant_blob(blob_id, owner)
+    return blob_id
+
+
+def grant_blob(blob_id, owner):
+    """Record that a user stored (and may see) a blob"""
+    blob_owners.update_one(
+        {'_id': f'{blob_id}:{owner}'},
+        {'$setOnInsert': {'created_at': time.time()}},
+        upsert=True
+    )
+
+
+def owns_blob(blob_id, owner):
+    return blob_owners.find_one({'_id': f'{blob_id}:{owner}'}, {'_id': 1}) is not None
+
+
+def get_blob(blob_id):
+    """Return (bytes, content_type) for an id, or None"""
+    if not is_image_id(blob_id):
+        return None
+    return backend.get(blob_id)
+
+
+def is_image_id(value):
+    return isinstance(value, str) and bool(_IMAGE_ID.match(value))
+
+
+def url_window():
+    """Number of the current IMAGE_URL_TTL window; image links change when it does"""
+    return int(time.time()) // IMAGE_URL_TTL
+
+
+def _link_signature(image_id, user_id, expires):
+    message = f'{image_id}:{user_id}:{expires}'.encode('utf-8')
+    return hmac.new(IMAGE_URL_SECRET, message, hashlib.sha256).hexdigest()[:32]
+
+
+def image_url(image_id, user_id, size=None):
+    """Signed link to a stored image (or one of its renditions) for one of its owners"""
+    expires = (url_window() + 2) * IMAGE_URL_TTL
+    path = f"{IMAGE_URL_PREFIX}{image_id}" + (f"/{size}" if size else '')
+    query = urlencode({'u': user_id, 'exp': expires, 'sig': _link_signature(image_id, user_id, expires)})
+    return f"{path}?{query}"
+
+
+def verify_image_link(image_id, args):
+    """The user an image link was signed for, or None if the signature is wrong or expired"""
+    user_id, signature = args.get('u', ''), args.get('sig', '')
+    try:
+        expires = int(args.get('exp', ''))
+    except ValueError:
+        return None
+    if expires < time.time() or not hmac.compare_digest(signature, _link_signature(image_id, user_id, expires)):
+        return None
+    return user_id
+
+
+def store_image(image, owner=None):
+    """
+    Store a data URI (or bare base64) image and return its id. Values that
+    already reference a stored image (its URL or id) are returned as ids,
+    provided `owner` owns it; otherwise ValueError is raised.
+    """
+    existing = parse_image_ref(image)
+    if existing:
+        if owner is not None and not owns_blob(existing, owner):
+            raise ValueError(f"Image {existing} not found")
+        return existing
+
+    if ',' in image:
+        image = image.split(',', 1)[1]
+    return put_blob(base64.b64decode(image), owner=owner)
+
+
+def parse_image_ref(value):
+    """Return the image id if `value` is one of our image URLs or ids, else None"""
+    if not isinstance(value, str):
+        return None
+    if value.startswith(IMAGE_URL_PREFIX):
+        value = value[len(IMAGE_URL_PREFIX):].split('?', 1)[0]
+    return value if is_image_id(value) else None
+
+
+def load_data_uri(image_id):
+    """Stored image as a data URI, for upstreams that need inline images"""
+    blob = get_blob(image_id)
+    if blob is None:
+        raise ValueError(f"Image {image_id} not found")
+    data, content_type = blob
+    return f"data:{content_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+
+def doc_image_urls(doc, ids_field, legacy_field, user_id):
+    """Image URLs for a user's document, falling back to inline images not yet migrated"""
+    if ids_field in doc:
+        return [image_url(image_id, user_id) for image_id in doc[ids_field]]
+    images = doc.get(legacy_field) or []
+    return images if isinstance(images, list) else [images]
+
+
+def doc_image_url(doc, id_field, legacy_field, user_id):
+    if doc.get(id_field):
+        return image_url(doc[id_field], user_id)
+    return doc.get(legacy_field, '')
+
+
+def doc_images_data(doc, ids_field, legacy_field):
+    """Inline data URIs for a document's images, loading them from the store if needed"""
+    if ids_field in doc:
+        return [load_data_uri(image_id) for image_id in doc[ids_field]]
+    images = doc.get(legacy_field) or []
+    return images if isinstance(images, list) else [images]
+
+
+def doc_image_data(doc, id_field, legacy_field):
+    if doc.get(id_field):
+        return load_data_uri(doc[id_field])
+    return doc.get(legacy_field, '')
+
+
+def sniff_content_type(data):
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    return 'application/octet-stream'
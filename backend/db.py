@@ -2,6 +2,8 @@ import os
 from pymongo import MongoClient
 from dotenv import load_dotenv
 
+from mongo_monitoring import command_timer
+
 # Load environment variables
 load_dotenv()
 
@@ -9,8 +11,18 @@ load_dotenv()
 MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
 DB_NAME = os.getenv('MONGO_DB_NAME', 'sustainable_shopper')
 
+# Connection pool settings for the client shared by every request and worker thread
+MONGO_POOL_OPTIONS = {
+    'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', '50')),
+    'minPoolSize': int(os.getenv('MONGO_MIN_POOL_SIZE', '0')),
+    'maxIdleTimeMS': int(os.getenv('MONGO_MAX_IDLE_MS', '300000')),
+    # Fail fast instead of queueing forever when the pool or server is exhausted
+    'waitQueueTimeoutMS': int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000')),
+    'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+}
+
 # Create MongoDB client
-client = MongoClient(MONGO_URI)
+client = MongoClient(MONGO_URI, event_listeners=[command_timer], **MONGO_POOL_OPTIONS)
 db = client[DB_NAME]
 
 # Collections
@@ -18,6 +30,12 @@ users = db.users
 try_on_history = db.try_on_history
 user_photos = db.user_photos
 wardrobe_items = db.wardrobe_items
+try_on_cache = db.try_on_cache
+image_renditions = db.image_renditions
+collection_versions = db.collection_versions
+outfit_cache = db.outfit_cache
+description_cache = db.description_cache
+blob_owners = db.blob_owners
 
 # Clothing categories and tags
 CLOTHING_CATEGORIES = {
@@ -0,0 +1,82 @@
+"""
+Content-addressed cache of garment descriptions.
+
+A description is keyed by the content hashes of the item's images (stored
+image ids are already SHA-256 digests) together with the model, so saving
+an item again or adding the same garment twice reuses the earlier
+description instead of calling the vision model.
+"""
+import os
+import time
+import hashlib
+import datetime
+import threading
+
+from db import description_cache
+
+CACHE_TTL = int(os.environ.get('DESCRIPTION_CACHE_TTL', str(90 * 24 * 3600)))
+DESCRIPTION_MODEL = 'gpt-4.1-mini'
+
+
+def description_key(image_digests, model=DESCRIPTION_MODEL):
+    """Cache key for a set of images given their content hashes; order does not matter"""
+    digest = hashlib.sha256(model.encode('utf-8'))
+    for image_digest in sorted(image_digests):
+        digest.update(b'\0' + image_digest.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class DescriptionCache:
+    """Persistent descriptions with in-process hit-rate counters"""
+
+    def __init__(self, collection=description_cache, ttl=CACHE_TTL):
+        self.collection = collection
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached description for a key, or None"""
+        try:
+            entry = self.collection.find_one({'_id': key, 'expires_at': {'$gt': time.time()}}, {'description': 1})
+        except Exception as e:
+            print(f"Description cache lookup failed: {e}")
+            entry = None
+
+        with self._lock:
+            if entry:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return entry['description'] if entry else None
+
+    def put(self, key, description):
+        now = time.time()
+        try:
+            self.collection.update_one(
+                {'_id': key},
+                {'$set': {
+                    'description': description,
+                    'created_at': now,
+                    'expires_at': now + self.ttl,
+                    'purge_at': datetime.datetime.utcfromtimestamp(now + self.ttl)
+                }},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Description cache write failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None
+            }
+
+
+# Shared cache used by describe_garment
+garment_description_cache = DescriptionCache()
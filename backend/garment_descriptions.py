@@ -0,0 +1,222 @@
+"""
+Background AI descriptions of wardrobe items.
+
+Saving an item no longer waits for the vision model: the item is stored
+with ai_description_status 'pending' and a small worker pool describes it,
+retrying failed attempts with exponential backoff. The status becomes
+'ready' or, once DESCRIPTION_ATTEMPTS attempts have failed, 'failed'. A
+description is only written while the item still has the images it was
+made from, so a later edit is never overwritten by an older result.
+Every DESCRIPTION_SWEEP_INTERVAL seconds, pending items whose worker was
+lost (e.g. in a restart) are claimed by one process and queued again, and
+images described before (see description_cache) skip the queue entirely.
+"""
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import repository
+from http_clients import openai_api, get_openai_client
+from images import normalize_image, decode_data_uri, to_data_uri
+from blob_store import get_blob, parse_image_ref
+from description_cache import garment_description_cache, description_key, DESCRIPTION_MODEL
+
+DESCRIPTION_WORKERS = int(os.environ.get('DESCRIPTION_WORKERS', '2'))
+DESCRIPTION_ATTEMPTS = int(os.environ.get('DESCRIPTION_ATTEMPTS', '3'))
+RETRY_DELAY = 10  # Seconds before the first retry; doubles for each later one
+STALE_AFTER = 10 * 60  # Pending descriptions older than this are requeued by the sweep
+SWEEP_INTERVAL = int(os.environ.get('DESCRIPTION_SWEEP_INTERVAL', '60'))
+
+PENDING, READY, FAILED = 'pending', 'ready', 'failed'
+
+
+def vision_data_uri(digest, data=None, original=None):
+    """
+    Data URI of an image sized for the vision model. Stored images are read
+    by id; images that are already suitable JPEGs are encoded once, and an
+    inline data URI that needs no change is passed straight through.
+    """
+    if data is None:
+        blob = get_blob(digest)
+        if blob is None:
+            raise ValueError(f"Image {digest} not found")
+        data = blob[0]
+
+    normalized, mime_type = normalize_image(data, 'openai')
+    if normalized is data and original and original.startswith(f'data:{mime_type};base64,'):
+        return original
+    return to_data_uri(normalized, mime_type)
+
+
+def describe_garment(images):
+    """
+    Given a list of 1-5 images (stored image ids or base64 data URIs), returns
+    a textual description of the garment/clothing item from the OpenAI API.
+    Descriptions are cached by the content hashes of the images.
+    """
+    if not (1 <= len(images) <= 5):
+        raise ValueError("You must provide between 1 and 5 images.")
+
+    # Stored images are addressed by content hash already; inline ones are hashed here
+    sources = []
+    for image in images:
+        image_id = parse_image_ref(image)
+        if image_id:
+            sources.append((image_id, None, None))
+        else:
+            data = decode_data_uri(image)
+            sources.append((hashlib.sha256(data).hexdigest(), data, image))
+
+    key = description_key([digest for digest, _, _ in sources])
+    cached = garment_description_cache.get(key)
+    if cached is not None:
+        return cached
+
+    # Prepare the multimodal content payload, sized for the vision model
+    content = [{"type": "input_image", "image_url": vision_data_uri(*source)} for source in sources]
+
+    # Append the user instruction
+    content.append({
+        "type": "input_text",
+        "text": "Please provide a detailed textual description of the garment or clothing item shown in these images."
+    })
+
+    # Call the ChatGPT API with GPT-4.1 Mini
+    response = openai_api.call(
+        get_openai_client().responses.create,
+        model=DESCRIPTION_MODEL,
+        input=[{"role": "user", "content": content}]
+    )
+
+    description = response.output_text
+    garment_description_cache.put(key, description)
+    return description
+
+
+def description_fields(image_ids):
+    """
+    Description fields for an item with new images: the cached description
+    when these images were described before, otherwise a pending status for
+    the queue to resolve.
+    """
+    cached = garment_description_cache.get(description_key(image_ids))
+    if cached is not None:
+        return {'ai_description': cached, 'ai_description_status': READY, 'ai_description_attempts': 0}
+
+    return {
+        'ai_description_status': PENDING,
+        'ai_description_attempts': 0,
+        'ai_description_requested_at': time.time()
+    }
+
+
+class DescriptionQueue:
+    """Describes wardrobe items on a worker pool, retrying failures"""
+
+    def __init__(self, workers=DESCRIPTION_WORKERS, attempts=DESCRIPTION_ATTEMPTS):
+        self.attempts = attempts
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='describe')
+        self._lock = threading.Lock()
+        self._counts = {'queued': 0, 'ready': 0, 'retried': 0, 'failed': 0, 'superseded': 0, 'requeued': 0}
+        self._in_flight = 0
+        self._active = set()  # Items queued, in flight or waiting for a retry here
+        self._sweeper = None
+
+    def start(self, interval=SWEEP_INTERVAL):
+        """Requeue stale items now and every `interval` seconds, in a background thread (once)"""
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep, args=(interval,), name='describe-sweep', daemon=True)
+                self._sweeper.start()
+
+    def _sweep(self, interval):
+        while True:
+            self.requeue_stale()
+            time.sleep(interval)
+
+    def submit(self, user_id, item_id, image_ids, attempt=1):
+        """Queue a description of the item's current images"""
+        with self._lock:
+            self._in_flight += 1
+            if attempt == 1:
+                self._counts['queued'] += 1
+                self._active.add(str(item_id))
+        self._pool.submit(self._describe, str(user_id), str(item_id), list(image_ids), attempt)
+
+    def requeue_stale(self, stale_after=STALE_AFTER):
+        """
+        Queue again the pending items whose worker was lost, e.g. in a restart.
+        Each item is claimed first, so only one process requeues it.
+        """
+        try:
+            items = repository.stale_descriptions(time.time() - stale_after)
+        except Exception as e:
+            print(f"Could not look up pending descriptions: {e}")
+            return 0
+
+        requeued = 0
+        for item in items:
+            with self._lock:
+                if str(item['_id']) in self._active:
+                    continue
+            try:
+                claimed = repository.claim_stale_description(item['_id'], item['ai_description_requested_at'])
+            except Exception as e:
+                print(f"Could not claim pending description of item {item['_id']}: {e}")
+                continue
+            if claimed:
+                self.submit(claimed['user_id'], claimed['_id'], claimed.get('image_ids', []))
+                requeued += 1
+
+        with self._lock:
+            self._counts['requeued'] += requeued
+        return requeued
+
+    def _describe(self, user_id, item_id, image_ids, attempt):
+        try:
+            description = describe_garment(image_ids)
+            self._finish(user_id, item_id, image_ids, {
+                'ai_description': description,
+                'ai_description_status': READY,
+                'ai_description_attempts': attempt
+            }, 'ready')
+        except Exception as e:
+            print(f"Error generating AI description for item {item_id} (attempt {attempt}): {e}")
+            if attempt < self.attempts:
+                with self._lock:
+                    self._counts['retried'] += 1
+                    self._in_flight -= 1
+                delay = RETRY_DELAY * 2 ** (attempt - 1)
+                timer = threading.Timer(delay, self.submit, (user_id, item_id, image_ids, attempt + 1))
+                timer.daemon = True
+                timer.start()
+            else:
+                # The previous description, if any, is kept
+                self._finish(user_id, item_id, image_ids, {
+                    'ai_description_status': FAILED,
+                    'ai_description_attempts': attempt
+                }, 'failed')
+
+    def _finish(self, user_id, item_id, image_ids, fields, outcome):
+        try:
+            if not repository.set_wardrobe_description(user_id, item_id, image_ids, fields):
+                # Deleted, or its images changed and a newer description is on its way
+                outcome = 'superseded'
+        except Exception as e:
+            print(f"Could not save AI description for item {item_id}: {e}")
+            outcome = 'failed'
+
+        with self._lock:
+            self._counts[outcome] += 1
+            self._in_flight -= 1
+            self._active.discard(item_id)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, in_flight=self._in_flight)
+
+
+# Shared queue used by the wardrobe routes
+description_queue = DescriptionQueue()
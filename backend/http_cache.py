@@ -0,0 +1,91 @@
+"""
+HTTP caching for image and per-user list endpoints.
+
+Stored images are addressed by content hash, so their id doubles as a strong
+ETag and they can be cached for as long as their signed link lasts, by the
+user's browser only. The wardrobe, photo and history lists
+are tagged with a per-user version number that is bumped on every write to
+the underlying collection; a request whose If-None-Match still matches gets
+a 304 after reading only that counter.
+"""
+import hashlib
+from functools import wraps
+
+from flask import request, make_response
+
+from db import collection_versions
+from blob_store import IMAGE_URL_TTL, url_window
+
+IMMUTABLE = f'private, max-age={IMAGE_URL_TTL}, immutable'
+# Lists are private and must be revalidated, which costs one counter lookup
+REVALIDATE = 'private, no-cache'
+
+# Response format of each list; bump it whenever the shape of a list's JSON
+# changes, so clients holding the old shape cannot revalidate it
+LIST_FORMATS = {
+    'history': 3,   # 2: {items, next_cursor} pages; 3: garment_medium
+    'wardrobe': 2,  # 2: ai_description_status
+    'photos': 1
+}
+
+
+def bump_version(user_id, name):
+    """Record a change to one of a user's lists (e.g. 'wardrobe')"""
+    collection_versions.update_one(
+        {'_id': f'{user_id}:{name}'},
+        {'$inc': {'version': 1}},
+        upsert=True
+    )
+
+
+def get_version(user_id, name):
+    entry = collection_versions.find_one({'_id': f'{user_id}:{name}'})
+    return entry.get('version', 0) if entry else 0
+
+
+def list_etag(user_id, name):
+    # Lists carry signed image links, which are reissued every URL window
+    tag = f'{name}-v{LIST_FORMATS.get(name, 1)}-{user_id}-{get_version(user_id, name)}-{url_window()}'
+    if request.query_string:
+        # Different pages or filters of the same list are different representations
+        tag += '-' + hashlib.sha1(request.query_string).hexdigest()[:12]
+    return tag
+
+
+def not_modified(etag, cache_control):
+    response = make_response('', 304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def versioned(name):
+    """
+    Decorator for GET endpoints returning a user's list. Must be applied
+    below token_required, as it needs the current user.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(current_user, *args, **kwargs):
+            # Read the version before the data, so a write racing with this
+            # request can only leave the client with an older tag, never a newer one
+            etag = list_etag(current_user['_id'], name)
+            if request.if_none_match.contains(etag):
+                return not_modified(etag, REVALIDATE)
+
+            response = make_response(f(current_user, *args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = REVALIDATE
+                response.vary.add('Authorization')
+            return response
+
+        return decorated
+    return decorator
+
+
+def immutable_response(response, etag):
+    """Mark a response for content that never changes under its URL"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = IMMUTABLE
+    return response
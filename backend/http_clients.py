@@ -0,0 +1,341 @@
+"""
+Shared outbound HTTP clients.
+
+Every upstream (Fashn, OpenAI, OpenWeatherMap, ip-api) gets one Upstream
+object holding a keep-alive connection pool, a concurrency limit, default
+timeouts, retries with jittered exponential backoff and a circuit breaker.
+Each Upstream also records latency and error counts, exposed through
+upstream_stats(). Streamed responses go through Upstream.stream(), which
+holds the concurrency slot until the stream is closed.
+"""
+import os
+import time
+import random
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RETRY_STATUSES = {429, 502, 503, 504}  # Worth retrying; the upstream did not handle the request
+LATENCY_SAMPLES = 500  # Recent request durations kept per upstream for percentiles
+
+
+class UpstreamError(Exception):
+    """Raised when a call is refused before it reaches the upstream"""
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class UpstreamBusyError(UpstreamError):
+    pass
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures and lets one trial call through after a cool-down"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+
+            if time.time() - self.opened_at >= self.reset_timeout:
+                # Let a single trial request through per cool-down period
+                self.state = 'half_open'
+                self.opened_at = time.time()
+                return True
+
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.time()
+
+
+class UpstreamStats:
+    """Thread-safe request counters and latency samples for one upstream"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+
+    def record(self, duration, error):
+        with self._lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+            self.latencies.append(duration)
+
+    def increment(self, field, amount=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            data = {
+                'requests': self.requests,
+                'errors': self.errors,
+                'retries': self.retries,
+                'rejected': self.rejected,
+                'in_flight': self.in_flight
+            }
+
+        if latencies:
+            data['latency_ms'] = {
+                'p50': round(_percentile(latencies, 0.50) * 1000, 1),
+                'p95': round(_percentile(latencies, 0.95) * 1000, 1),
+                'max': round(latencies[-1] * 1000, 1)
+            }
+
+        return data
+
+
+class Upstream:
+    """A pooled, rate-limited and circuit-protected client for one remote service"""
+
+    def __init__(self, name, pool_size=10, max_concurrency=10, timeout=(5, 30), retries=2,
+                 backoff=0.5, acquire_timeout=10, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.acquire_timeout = acquire_timeout
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.stats = UpstreamStats()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+        # One keep-alive pool per upstream host
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, idempotent=False, **kwargs):
+        return self.request('POST', url, idempotent=idempotent, **kwargs)
+
+    def request(self, method, url, idempotent=True, **kwargs):
+        """
+        Send a request through the shared session. Non-idempotent requests are
+        only retried when the upstream could not have acted on them.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+
+        def send():
+            return self.session.request(method, url, **kwargs)
+
+        def should_retry(response, error):
+            if error is not None:
+                return idempotent or isinstance(error, requests.exceptions.ConnectTimeout)
+            if response.status_code == 429:
+                return True
+            return idempotent and response.status_code in RETRY_STATUSES
+
+        return self._execute(send, should_retry, self.retries)
+
+    def call(self, fn, *args, retries=None, acquire_timeout=None, **kwargs):
+        """
+        Run an SDK call (e.g. the OpenAI client) under this upstream's limits
+        and metrics. `acquire_timeout` overrides how long to wait for a free
+        slot, e.g. to stay within a caller's latency budget.
+        """
+        def send():
+            return fn(*args, **kwargs)
+
+        def should_retry(response, error):
+            return error is not None
+
+        return self._execute(
+            send, should_retry,
+            self.retries if retries is None else retries,
+            self.acquire_timeout if acquire_timeout is None else acquire_timeout
+        )
+
+    @contextmanager
+    def stream(self, fn, *args, acquire_timeout=None, caller_errors=(), **kwargs):
+        """
+        Run an SDK call that returns a stream (e.g. with stream=True) and
+        yield the stream. The concurrency slot is held until the block exits
+        and the stream is closed; the call counts as failed if reading it
+        raised. Exceptions of the `caller_errors` types are the caller giving
+        up (e.g. its own deadline) and, like a consumer that goes away, are
+        not held against the upstream. Streams are never retried.
+        """
+        if not self.breaker.allow():
+            self.stats.increment('rejected')
+            raise CircuitOpenError(f'{self.name} circuit is open')
+
+        if not self._slots.acquire(timeout=self.acquire_timeout if acquire_timeout is None else acquire_timeout):
+            self.stats.increment('rejected')
+            raise UpstreamBusyError(f'{self.name} concurrency limit reached')
+
+        self.stats.increment('in_flight')
+        start = time.time()
+        outcome = 'failed'
+        try:
+            with fn(*args, **kwargs) as stream:
+                yield stream
+            outcome = 'succeeded'
+        except GeneratorExit:
+            # The consumer went away (e.g. the client disconnected)
+            outcome = 'abandoned'
+            raise
+        except caller_errors:
+            outcome = 'abandoned'
+            raise
+        finally:
+            self.stats.increment('in_flight', -1)
+            self._slots.release()
+            self.stats.record(time.time() - start, outcome == 'failed')
+            if outcome == 'failed':
+                self.breaker.record_failure()
+            elif outcome == 'succeeded':
+                self.breaker.record_success()
+
+    def _execute(self, send, should_retry, retries, acquire_timeout=None):
+        if not self.breaker.allow():
+            self.stats.increment('rejected')
+            raise CircuitOpenError(f'{self.name} circuit is open')
+
+        for attempt in range(retries + 1):
+            if not self._slots.acquire(timeout=self.acquire_timeout if acquire_timeout is None else acquire_timeout):
+                self.stats.increment('rejected')
+                raise UpstreamBusyError(f'{self.name} concurrency limit reached')
+
+            response, error = None, None
+            self.stats.increment('in_flight')
+            start = time.time()
+            try:
+                response = send()
+            except Exception as e:
+                error = e
+            finally:
+                self.stats.increment('in_flight', -1)
+                self._slots.release()
+
+            failed = error is not None or _is_server_failure(response)
+            self.stats.record(time.time() - start, failed)
+
+            if attempt < retries and should_retry(response, error):
+                self.stats.increment('retries')
+                # Full jitter: sleep somewhere between 0 and the exponential cap
+                time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+                continue
+
+            if failed:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+            if error is not None:
+                raise error
+            return response
+
+    def snapshot(self):
+        data = self.stats.snapshot()
+        data['circuit'] = self.breaker.state
+        return data
+
+
+def _is_server_failure(response):
+    status_code = getattr(response, 'status_code', None)
+    return status_code is not None and (status_code >= 500 or status_code == 429)
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, str(default)))
+
+
+# Shared upstreams
+fashn = Upstream(
+    'fashn',
+    pool_size=_env_int('FASHN_POOL_SIZE', 16),
+    max_concurrency=_env_int('FASHN_MAX_CONCURRENCY', 16),
+    timeout=(5, 30)
+)
+openweather = Upstream(
+    'openweather',
+    pool_size=_env_int('OPENWEATHER_POOL_SIZE', 8),
+    max_concurrency=_env_int('OPENWEATHER_MAX_CONCURRENCY', 8),
+    timeout=(3, 10)
+)
+ip_api = Upstream(
+    'ip_api',
+    pool_size=4,
+    max_concurrency=4,
+    timeout=(3, 5)
+)
+# The OpenAI SDK already retries with jittered backoff, so this wrapper does not
+openai_api = Upstream(
+    'openai',
+    max_concurrency=_env_int('OPENAI_MAX_CONCURRENCY', 8),
+    timeout=float(os.environ.get('OPENAI_TIMEOUT', '60')),
+    retries=0,
+    acquire_timeout=30
+)
+
+UPSTREAMS = {upstream.name: upstream for upstream in (fashn, openweather, ip_api, openai_api)}
+
+_openai_client = None
+_openai_lock = threading.Lock()
+
+
+def get_openai_client():
+    """Return the process-wide OpenAI client, which keeps its own connection pool"""
+    global _openai_client
+    if _openai_client is None:
+        with _openai_lock:
+            if _openai_client is None:
+                import httpx
+                from openai import OpenAI
+
+                pool_size = _env_int('OPENAI_POOL_SIZE', 8)
+                _openai_client = OpenAI(
+                    api_key=os.environ.get('OPENAI_API_KEY', ''),
+                    timeout=openai_api.timeout,
+                    max_retries=2,
+                    http_client=httpx.Client(
+                        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+                    )
+                )
+    return _openai_client
+
+
+def upstream_stats():
+    """Latency, error and circuit state for every upstream"""
+    return {name: upstream.snapshot() for name, upstream in UPSTREAMS.items()}
@@ -0,0 +1,119 @@
+"""
+Image normalization before images are stored or sent upstream.
+
+Uploads are decoded once, rotated according to their EXIF orientation,
+downscaled to the largest size the target upstream makes use of and
+re-encoded as JPEG, so the data URIs we forward are an order of magnitude
+smaller and always carry the right MIME type.
+"""
+import io
+import os
+import base64
+import threading
+
+from PIL import Image, ImageOps
+
+# Largest useful image side (pixels) and JPEG quality for each consumer
+TARGETS = {
+    # Fashn works on images well under 2k; garment detail survives at this size
+    'fashn': {'max_side': int(os.environ.get('FASHN_IMAGE_MAX_SIDE', '1536')), 'quality': 90},
+    # OpenAI vision scales everything to fit 768px on the short side
+    'openai': {'max_side': int(os.environ.get('OPENAI_IMAGE_MAX_SIDE', '1024')), 'quality': 85},
+}
+
+EXIF_ORIENTATION = 0x0112
+
+
+class ImageStats:
+    """Bytes in versus bytes out of the normalization stage"""
+
+    def __init__(self):
+        self.images = 0
+        self.passed_through = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+
+    def record(self, bytes_in, bytes_out, passed_through):
+        with self._lock:
+            self.images += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            if passed_through:
+                self.passed_through += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'images': self.images,
+                'passed_through': self.passed_through,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'reduction': round(self.bytes_in / self.bytes_out, 1) if self.bytes_out else None
+            }
+
+
+image_stats = ImageStats()
+
+
+def normalize_image(data, target='fashn'):
+    """
+    Return (jpeg_bytes, 'image/jpeg') for raw image bytes, sized for the
+    target upstream. Images that are already suitable JPEGs are returned
+    untouched. Raises ValueError if the bytes are not a readable image.
+    """
+    settings = TARGETS[target]
+    max_side = settings['max_side']
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        # Only the header has been read so far; this is cheap
+        needs_rotation = image.getexif().get(EXIF_ORIENTATION, 1) != 1
+        if image.format == 'JPEG' and image.mode == 'RGB' and not needs_rotation and max(image.size) <= max_side:
+            image_stats.record(len(data), len(data), True)
+            return data, 'image/jpeg'
+
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        image = _flatten(image)
+
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=settings['quality'], optimize=True, progressive=True)
+    except Exception as e:
+        raise ValueError(f"Unreadable image: {e}")
+
+    normalized = output.getvalue()
+    image_stats.record(len(data), len(normalized), False)
+    return normalized, 'image/jpeg'
+
+
+def normalize_upload(file_storage, target='fashn'):
+    """Normalize an uploaded file and return it as a data URI"""
+    data, mime_type = normalize_image(file_storage.read(), target)
+    return to_data_uri(data, mime_type)
+
+
+def normalize_data_uri(image, target='fashn'):
+    """Normalize a base64 image (with or without a data URI prefix) and return a data URI"""
+    data, mime_type = normalize_image(decode_data_uri(image), target)
+    return to_data_uri(data, mime_type)
+
+
+def decode_data_uri(image):
+    if ',' in image:
+        image = image.split(',', 1)[1]
+    return base64.b64decode(image)
+
+
+def to_data_uri(data, mime_type='image/jpeg'):
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+
+def _flatten(image):
+    # JPEG has no alpha channel; composite transparent images onto white
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        return background
+    return image.convert('RGB')
@@ -0,0 +1,121 @@
+"""
+MongoDB indexes for the queries the app runs on every request.
+
+ensure_indexes() is called at startup; create_index is a no-op for indexes
+that already exist, so it is safe to run on every boot. Run this module to
+explain each route's query and flag any that still scan a whole collection:
+
+    python indexes.py [--user-id <id>] [--create]
+"""
+import argparse
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+from db import users, try_on_history, user_photos, wardrobe_items, try_on_cache, outfit_cache, description_cache
+
+# (collection, keys, options)
+INDEXES = [
+    # Login and registration look users up by email
+    (users, [('email', ASCENDING)], {'name': 'email_unique', 'unique': True}),
+    # The outfit precompute batch picks recently active users
+    (users, [('last_active_at', DESCENDING)], {'name': 'last_active'}),
+    # History pages sort on created_at with _id as the tie-breaker
+    (try_on_history, [('user_id', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)],
+     {'name': 'user_created'}),
+    (user_photos, [('user_id', ASCENDING), ('created_at', DESCENDING)], {'name': 'user_created'}),
+    (wardrobe_items, [('user_id', ASCENDING), ('created_at', DESCENDING)], {'name': 'user_created'}),
+    # Outfit suggestions only consider items that are clean and available
+    (wardrobe_items, [('user_id', ASCENDING), ('in_laundry', ASCENDING), ('unavailable', ASCENDING)],
+     {'name': 'user_availability'}),
+    # Only items still waiting for an AI description are indexed
+    (wardrobe_items, [('ai_description_status', ASCENDING), ('ai_description_requested_at', ASCENDING)],
+     {'name': 'pending_descriptions', 'partialFilterExpression': {'ai_description_status': 'pending'}}),
+    # Let MongoDB drop expired try-on results
+    (try_on_cache, [('purge_at', ASCENDING)], {'name': 'purge_at_ttl', 'expireAfterSeconds': 0}),
+    # Outfit suggestions are dropped per user when their wardrobe changes, and expire
+    (outfit_cache, [('user_id', ASCENDING)], {'name': 'user'}),
+    (outfit_cache, [('purge_at', ASCENDING)], {'name': 'purge_at_ttl', 'expireAfterSeconds': 0}),
+    (description_cache, [('purge_at', ASCENDING)], {'name': 'purge_at_ttl', 'expireAfterSeconds': 0}),
+]
+
+
+def ensure_indexes():
+    """Create any missing indexes; failures are reported, not raised"""
+    for collection, keys, options in INDEXES:
+        try:
+            collection.create_index(keys, **options)
+        except PyMongoError as e:
+            print(f"Could not create index {options['name']} on {collection.name}: {e}")
+
+
+def route_queries(user_id):
+    """The hot queries issued by the routes, as (label, collection, filter, sort)"""
+    return [
+        ('login', users, {'email': 'someone@example.com'}, None),
+        ('GET /api/history', try_on_history, {'user_id': user_id},
+         [('created_at', DESCENDING), ('_id', DESCENDING)]),
+        ('GET /api/photos', user_photos, {'user_id': user_id}, [('created_at', DESCENDING)]),
+        ('GET /api/wardrobe', wardrobe_items, {'user_id': user_id}, [('created_at', DESCENDING)]),
+        ('POST /api/outfit-suggestions', wardrobe_items,
+         {'user_id': user_id, 'in_laundry': False, 'unavailable': False}, None),
+    ]
+
+
+def plan_stages(plan):
+    """All stage names in an explain plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for key in ('inputStage', 'queryPlan'):
+            if key in plan:
+                stages.extend(plan_stages(plan[key]))
+        for child in plan.get('inputStages', []):
+            stages.extend(plan_stages(child))
+    return stages
+
+
+def explain_routes(user_id):
+    """Print the winning plan of each route query; returns the labels that scan a collection"""
+    scans = []
+    for label, collection, query, sort in route_queries(user_id):
+        cursor = collection.find(query).limit(50)
+        if sort:
+            cursor = cursor.sort(sort)
+
+        explanation = cursor.explain()
+        stages = plan_stages(explanation.get('queryPlanner', {}).get('winningPlan', {}))
+        flag = 'COLLSCAN' if 'COLLSCAN' in stages else 'ok'
+        if flag == 'COLLSCAN':
+            scans.append(label)
+
+        stats = explanation.get('executionStats', {})
+        examined = stats.get('totalDocsExamined')
+        print(f"{flag:8} {label:32} {' <- '.join(stages)}" + (f" (docs examined: {examined})" if examined is not None else ""))
+
+    return scans
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Explain the app's hot queries and flag collection scans")
+    parser.add_argument('--user-id', help="User whose queries to explain (defaults to any user)")
+    parser.add_argument('--create', action='store_true', help="Create missing indexes first")
+    args = parser.parse_args()
+
+    if args.create:
+        ensure_indexes()
+
+    user_id = args.user_id
+    if not user_id:
+        user = users.find_one({}, {'_id': 1})
+        user_id = str(user['_id']) if user else 'unknown'
+
+    scans = explain_routes(user_id)
+    if scans:
+        print(f"\n{len(scans)} queries scan a whole collection; run with --create to add the missing indexes")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
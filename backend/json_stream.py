@@ -0,0 +1,78 @@
+"""
+Incremental JSON parsing of streamed model output.
+
+The model answers with one JSON object such as {"outfits": [{...}, {...}]},
+possibly wrapped in a markdown code fence. ArrayItemStream is fed the text
+as it arrives and returns every element of the root object's array as soon
+as that element's closing brace is seen, so the first outfit can be shown
+long before the last one has been generated.
+"""
+import json
+
+
+class ArrayItemStream:
+    """Yields the objects inside the array held by the root JSON object (`key`, if given)"""
+
+    def __init__(self, key=None):
+        self.key = key
+        self.stack = []          # Open containers: '{' or '['
+        self.in_string = False
+        self.escaped = False
+        self.done = False
+        self.buffer = ''         # Text of the element being read
+        self.in_item = False
+        self.string = ''         # Last string literal read in the root object
+        self.last_key = None
+        self.array_key = None    # Key of the array currently open in the root object
+
+    def feed(self, text):
+        """Consume more text; returns the elements completed by it"""
+        items = []
+        for char in text:
+            if self.done:
+                break
+            if self.in_item:
+                self.buffer += char
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                elif len(self.stack) == 1:
+                    self.string += char
+                continue
+
+            if not self.stack:
+                # Anything before the root object (a code fence, prose) is ignored
+                if char == '{':
+                    self.stack.append('{')
+                continue
+
+            if char == '"':
+                self.in_string = True
+                if len(self.stack) == 1:
+                    self.string = ''
+            elif char == ':' and len(self.stack) == 1:
+                self.last_key = self.string
+            elif char in '{[':
+                if len(self.stack) == 1 and char == '[':
+                    self.array_key = self.last_key
+                elif len(self.stack) == 2 and self.stack[1] == '[' and char == '{' and self._wanted():
+                    self.in_item = True
+                    self.buffer = char
+                self.stack.append(char)
+            elif char in '}]':
+                self.stack.pop()
+                if len(self.stack) == 2 and self.in_item:
+                    items.append(json.loads(self.buffer))
+                    self.in_item = False
+                    self.buffer = ''
+                elif not self.stack:
+                    self.done = True
+        return items
+
+    def _wanted(self):
+        return self.key is None or self.array_key == self.key
@@ -0,0 +1,250 @@
+"""
+Move inline base64 images out of MongoDB documents and into the blob store.
+
+Streams try_on_history, user_photos and wardrobe_items in _id order, one
+batch at a time, stores each image once (deduplicated by content hash) and
+rewrites the documents with bulk writes to reference the stored ids. Progress
+is checkpointed per collection, so an interrupted run picks up where it left
+off. Updates only apply to documents that still carry inline images, so the
+app can keep serving traffic while this runs. An image that cannot be read
+is logged, counted and left inline; run again with --restart to retry it.
+
+Each stored image is recorded as owned by the document's user. Documents that
+already referenced stored images before owners were recorded get them with
+--grant-owners.
+
+Usage:
+    python migrate_images.py [--collections user_photos wardrobe_items]
+                             [--batch-size 20] [--pause 0.5] [--normalize]
+                             [--dry-run] [--restart] [--grant-owners]
+"""
+import time
+import hashlib
+import argparse
+import datetime
+
+from pymongo import UpdateOne
+
+from db import db, try_on_history, user_photos, wardrobe_items
+from blob_store import put_blob, grant_blob
+from http_cache import bump_version
+from images import decode_data_uri, normalize_image
+
+migrations = db.migrations
+
+KNOWN_BLOB_LIMIT = 50000  # Cap on remembered blob ids, to keep memory bounded
+
+# collection -> (collection, cached list name, [(inline field, reference field, holds a list)])
+MIGRATIONS = {
+    'try_on_history': (try_on_history, 'history', [
+        ('model_image', 'model_image_id', False),
+        ('garment_image', 'garment_image_id', False)
+    ]),
+    'user_photos': (user_photos, 'photos', [
+        ('image', 'image_id', False)
+    ]),
+    'wardrobe_items': (wardrobe_items, 'wardrobe', [
+        ('images', 'image_ids', True)
+    ]),
+}
+
+
+class ImageMigration:
+    """Migrates one collection, batch by batch, from its last checkpoint"""
+
+    def __init__(self, name, batch_size=20, pause=0.0, normalize=False, dry_run=False):
+        self.name = name
+        self.collection, self.list_name, self.fields = MIGRATIONS[name]
+        self.batch_size = batch_size
+        self.pause = pause
+        self.normalize = normalize
+        self.dry_run = dry_run
+        self.checkpoint_id = f'images:{name}'
+        self.stored_ids = set()  # Blobs known to exist, to skip repeat lookups within a run
+
+        self.documents = 0
+        self.images = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.failed = 0
+
+    def run(self, restart=False):
+        if restart and not self.dry_run:
+            migrations.delete_one({'_id': self.checkpoint_id})
+
+        last_id = self._load_checkpoint()
+        started = time.time()
+        print(f"[{self.name}] starting" + (f" after {last_id}" if last_id else ""))
+
+        while True:
+            batch = self._next_batch(last_id)
+            if not batch:
+                break
+
+            operations = [self._rewrite(doc) for doc in batch]
+            operations = [op for op in operations if op is not None]
+
+            if operations and not self.dry_run:
+                self.collection.bulk_write(operations, ordered=False)
+                # Lists now carry URLs instead of inline images; invalidate cached copies
+                for user_id in {doc.get('user_id') for doc in batch if doc.get('user_id')}:
+                    bump_version(user_id, self.list_name)
+
+            last_id = batch[-1]['_id']
+            self.documents += len(operations)
+            if not self.dry_run:
+                self._save_checkpoint(last_id, len(operations))
+
+            self._report(started)
+
+            # Yield to live traffic between batches
+            if self.pause:
+                time.sleep(self.pause)
+
+        if not self.dry_run:
+            migrations.update_one(
+                {'_id': self.checkpoint_id},
+                {'$set': {'completed_at': datetime.datetime.utcnow()}},
+                upsert=True
+            )
+        print(f"[{self.name}] done")
+        self._report(started)
+
+    def _next_batch(self, last_id):
+        query = {'$or': [{field: {'$exists': True}} for field, _, _ in self.fields]}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+
+        projection = {field: 1 for field, _, _ in self.fields}
+        projection['user_id'] = 1
+        cursor = self.collection.find(query, projection, batch_size=self.batch_size)
+        return list(cursor.sort('_id', 1).limit(self.batch_size))
+
+    def _rewrite(self, doc):
+        update = {'$set': {}, '$unset': {}}
+        guard = {'_id': doc['_id']}
+
+        for field, ref_field, is_list in self.fields:
+            if field not in doc:
+                continue
+
+            value = doc[field]
+            try:
+                if is_list:
+                    stored = [self._store(image, doc.get('user_id')) for image in (value or []) if image]
+                elif value:
+                    stored = self._store(value, doc.get('user_id'))
+            except Exception as e:
+                # Leave this field inline and carry on with the rest of the batch
+                print(f"[{self.name}] could not move {field} of {doc['_id']}: {e}")
+                self.failed += 1
+                continue
+
+            # Skip the document if the app rewrote it since we read it
+            guard[field] = {'$exists': True}
+            guard[ref_field] = {'$exists': False}
+
+            if is_list or value:
+                update['$set'][ref_field] = stored
+            update['$unset'][field] = ''
+
+        if not update['$unset']:
+            return None
+        if not update['$set']:
+            del update['$set']
+
+        return UpdateOne(guard, update)
+
+    def _store(self, image, owner):
+        data = decode_data_uri(image)
+        self.images += 1
+        self.bytes_in += len(data)
+
+        content_type = None
+        if self.normalize:
+            try:
+                data, content_type = normalize_image(data, 'fashn')
+            except ValueError as e:
+                print(f"[{self.name}] keeping unreadable image as-is: {e}")
+        self.bytes_out += len(data)
+
+        if self.dry_run:
+            return None
+
+        blob_id = hashlib.sha256(data).hexdigest()
+        if blob_id not in self.stored_ids:
+            put_blob(data, content_type)
+            if len(self.stored_ids) >= KNOWN_BLOB_LIMIT:
+                self.stored_ids.clear()
+            self.stored_ids.add(blob_id)
+        if owner:
+            grant_blob(blob_id, owner)
+        return blob_id
+
+    def grant_owners(self):
+        """Record the users of documents that already reference stored images as their owners"""
+        query = {'$or': [{ref_field: {'$exists': True}} for _, ref_field, _ in self.fields]}
+        projection = {ref_field: 1 for _, ref_field, _ in self.fields}
+        projection['user_id'] = 1
+
+        granted = 0
+        for doc in self.collection.find(query, projection, batch_size=self.batch_size):
+            if not doc.get('user_id'):
+                continue
+            for _, ref_field, is_list in self.fields:
+                value = doc.get(ref_field)
+                for blob_id in (value or []) if is_list else [value] if value else []:
+                    if not self.dry_run:
+                        grant_blob(blob_id, doc['user_id'])
+                    granted += 1
+        print(f"[{self.name}] {granted} image owners recorded")
+
+    def _load_checkpoint(self):
+        checkpoint = migrations.find_one({'_id': self.checkpoint_id})
+        return checkpoint.get('last_id') if checkpoint else None
+
+    def _save_checkpoint(self, last_id, migrated):
+        migrations.update_one(
+            {'_id': self.checkpoint_id},
+            {
+                '$set': {'last_id': last_id, 'updated_at': datetime.datetime.utcnow()},
+                '$inc': {'documents': migrated}
+            },
+            upsert=True
+        )
+
+    def _report(self, started):
+        elapsed = max(time.time() - started, 1e-6)
+        print(
+            f"[{self.name}] {self.documents} docs, {self.images} images, {self.failed} failed, "
+            f"{self.bytes_in / 1e6:.1f} MB read, {self.bytes_out / 1e6:.1f} MB stored, "
+            f"{self.documents / elapsed:.1f} docs/s, {self.bytes_in / 1e6 / elapsed:.2f} MB/s"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move inline base64 images into the blob store")
+    parser.add_argument('--collections', nargs='+', choices=list(MIGRATIONS), default=list(MIGRATIONS))
+    parser.add_argument('--batch-size', type=int, default=20, help="Documents per batch (bounds memory use)")
+    parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches")
+    parser.add_argument('--normalize', action='store_true', help="Downscale and re-encode images while moving them")
+    parser.add_argument('--dry-run', action='store_true', help="Read and report without writing anything")
+    parser.add_argument('--restart', action='store_true', help="Ignore saved checkpoints")
+    parser.add_argument('--grant-owners', action='store_true', help="Also record owners of images stored before owners were")
+    args = parser.parse_args()
+
+    for name in args.collections:
+        migration = ImageMigration(
+            name,
+            batch_size=args.batch_size,
+            pause=args.pause,
+            normalize=args.normalize,
+            dry_run=args.dry_run
+        )
+        migration.run(restart=args.restart)
+        if args.grant_owners:
+            migration.grant_owners()
+
+
+if __name__ == "__main__":
+    main()
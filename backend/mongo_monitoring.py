@@ -0,0 +1,78 @@
+"""
+Per-operation timing for MongoDB commands.
+
+A pymongo CommandListener registered on the shared client records the
+duration of every command, grouped by collection and command name, and logs
+commands slower than MONGO_SLOW_MS. The numbers are exposed through
+/api/metrics.
+"""
+import os
+import threading
+from collections import deque
+
+from pymongo import monitoring
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SLOW_COMMAND_MS = float(os.environ.get('MONGO_SLOW_MS', '100'))
+LATENCY_SAMPLES = 200  # Recent durations kept per operation for percentiles
+
+
+class OperationStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def snapshot(self):
+        latencies = sorted(self.latencies)
+        data = {'count': self.count, 'errors': self.errors}
+        if latencies:
+            data['latency_ms'] = {
+                'p50': round(latencies[len(latencies) // 2], 2),
+                'p95': round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], 2),
+                'max': round(latencies[-1], 2)
+            }
+        return data
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Times commands by '<collection>.<command>'"""
+
+    def __init__(self):
+        self.operations = {}
+        self._started = {}  # request_id -> operation name, between started and finished events
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        name = f"{collection}.{event.command_name}" if isinstance(collection, str) else event.command_name
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = name
+
+    def succeeded(self, event):
+        self._finish(event, error=False)
+
+    def failed(self, event):
+        self._finish(event, error=True)
+
+    def _finish(self, event, error):
+        duration_ms = event.duration_micros / 1000
+        with self._lock:
+            name = self._started.pop((event.connection_id, event.request_id), event.command_name)
+            stats = self.operations.setdefault(name, OperationStats())
+            stats.count += 1
+            if error:
+                stats.errors += 1
+            stats.latencies.append(duration_ms)
+
+        if duration_ms >= SLOW_COMMAND_MS:
+            print(f"Slow MongoDB command {name}: {duration_ms:.1f} ms")
+
+    def snapshot(self):
+        with self._lock:
+            return {name: stats.snapshot() for name, stats in sorted(self.operations.items())}
+
+
+command_timer = CommandTimer()
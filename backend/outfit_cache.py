@@ -0,0 +1,125 @@
+"""
+Cache of outfit suggestions.
+
+Suggestions are keyed by the set of available wardrobe items, the
+normalized occasion and a coarse weather signature (a temperature band plus
+the weather condition), so asking the same thing again with the same clean
+clothes in much the same weather is answered without calling the model.
+Entries expire after OUTFIT_CACHE_TTL seconds and a user's entries are
+dropped whenever their wardrobe changes.
+"""
+import os
+import re
+import time
+import json
+import hashlib
+import datetime
+import threading
+
+from db import outfit_cache
+
+CACHE_TTL = int(os.environ.get('OUTFIT_CACHE_TTL', str(6 * 3600)))
+TEMPERATURE_BAND = 5  # °C per weather bucket
+
+
+def normalize_occasion(occasion):
+    """'  Job Interview!! ' and 'job interview' are the same request"""
+    return ' '.join(re.sub(r'[^\w\s]', ' ', str(occasion).lower()).split())
+
+
+def weather_bucket(weather_data):
+    """Temperature band and condition of an OpenWeatherMap payload, e.g. '15-20:rain'"""
+    weather_data = weather_data or {}
+
+    temperature = (weather_data.get('main') or {}).get('temp')
+    if isinstance(temperature, (int, float)):
+        low = int(temperature // TEMPERATURE_BAND) * TEMPERATURE_BAND
+        band = f"{low}-{low + TEMPERATURE_BAND}"
+    else:
+        band = 'unknown'
+
+    conditions = weather_data.get('weather') or []
+    condition = str(conditions[0].get('main', 'unknown')).lower() if conditions else 'unknown'
+
+    return f"{band}:{condition}"
+
+
+def suggestion_key(item_ids, occasion, weather_data, mode='llm'):
+    digest = hashlib.sha256()
+    digest.update(','.join(sorted(str(item_id) for item_id in item_ids)).encode('utf-8'))
+    digest.update(b'\0' + normalize_occasion(occasion).encode('utf-8'))
+    digest.update(b'\0' + weather_bucket(weather_data).encode('utf-8'))
+    digest.update(b'\0' + mode.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class OutfitCache:
+    """Persistent outfit suggestions with in-process hit-rate counters"""
+
+    def __init__(self, collection=outfit_cache, ttl=CACHE_TTL):
+        self.collection = collection
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return cached suggestions for a key, or None"""
+        try:
+            entry = self.collection.find_one({'_id': key, 'expires_at': {'$gt': time.time()}})
+        except Exception as e:
+            print(f"Outfit cache lookup failed: {e}")
+            entry = None
+
+        with self._lock:
+            if entry:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return json.loads(entry['suggestions']) if entry else None
+
+    def contains(self, key):
+        """Whether a fresh entry exists, without counting a lookup"""
+        try:
+            return self.collection.count_documents({'_id': key, 'expires_at': {'$gt': time.time()}}, limit=1) > 0
+        except Exception as e:
+            print(f"Outfit cache lookup failed: {e}")
+            return False
+
+    def put(self, key, user_id, suggestions):
+        now = time.time()
+        try:
+            self.collection.update_one(
+                {'_id': key},
+                {'$set': {
+                    'user_id': str(user_id),
+                    # Stored as text; suggestions are opaque here and may hold keys Mongo rejects
+                    'suggestions': json.dumps(suggestions),
+                    'created_at': now,
+                    'expires_at': now + self.ttl,
+                    'purge_at': datetime.datetime.utcfromtimestamp(now + self.ttl)
+                }},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Outfit cache write failed: {e}")
+
+    def invalidate(self, user_id):
+        try:
+            self.collection.delete_many({'user_id': str(user_id)})
+        except Exception as e:
+            print(f"Outfit cache invalidation failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None
+            }
+
+
+# Shared cache used by the outfit suggestion routes
+suggestion_cache = OutfitCache()
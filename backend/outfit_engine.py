@@ -0,0 +1,135 @@
+"""
+Deterministic local outfit generator.
+
+Builds outfits from CLOTHING_CATEGORIES slots: a top with a bottom or a
+dress/jumpsuit, outerwear when it is cold, plus footwear and an accessory
+when the wardrobe has them. Items are scored for the occasion and weather
+by outfit_ranking; with OUTFIT_RANKER=clip, outfits whose items sit close
+together in CLIP embedding space score higher. Returns the same shape as
+the model's suggestions, in milliseconds, and serves both as a mode of its
+own and as the fallback when the model is slow or unavailable.
+"""
+import itertools
+
+from outfit_ranking import score_items, weather_signals, clip_encoder, RANKER
+
+PER_SLOT = 6  # Best candidates per slot considered; bounds the combinations
+OUTFIT_COUNT = 3
+COLD = 15     # °C below which outerwear is added
+HOT = 24      # °C above which outerwear is left out
+REUSE_PENALTY = 1.5
+
+
+def slot_candidates(items, scores, category):
+    ranked = sorted(
+        (item for item in items if item.get('category') == category),
+        key=lambda item: (-scores[str(item['_id'])], str(item['_id']))
+    )
+    return ranked[:PER_SLOT]
+
+
+def outfit_signature(outfit):
+    return frozenset(str(item['_id']) for item in outfit if item['category'] != 'Accessories')
+
+
+def compatibility(outfit, embeddings):
+    """Mean pairwise cosine similarity of the outfit's item embeddings"""
+    vectors = [embeddings[str(item['_id'])] for item in outfit if str(item['_id']) in embeddings]
+    pairs = list(itertools.combinations(vectors, 2))
+    if not pairs:
+        return 0.0
+    return sum(float(a @ b) for a, b in pairs) / len(pairs)
+
+
+def styling_tip(outfit, occasion, temperature, condition):
+    names = {item['category']: item.get('name') or item['tag'].lower() for item in outfit}
+    # Only name the slots the outfit actually fills
+    base = names.get('Dresses & Jumpsuits') or " with ".join(
+        names[category] for category in ('Tops', 'Bottoms') if category in names
+    )
+    pieces = [piece for piece in (base, names.get('Footwear')) if piece]
+
+    tip = f"Wear the {' and '.join(pieces)} for {occasion}."
+    if 'Outerwear' in names:
+        tip += f" Layer the {names['Outerwear']} on top"
+        tip += f" against the {temperature:.0f}°C chill." if temperature is not None else "."
+    if condition in ('rain', 'drizzle', 'thunderstorm'):
+        tip += " Rain is expected, so keep an umbrella handy."
+    if 'Accessories' in names:
+        tip += f" Finish with the {names['Accessories']}."
+    return tip
+
+
+def suggest_outfits(items, occasion, weather_data, count=OUTFIT_COUNT):
+    """Up to `count` outfits as {'outfits': [{'items': [{id, category}], 'styling'}]}"""
+    scores = score_items(items, occasion, weather_data)
+    temperature, condition = weather_signals(weather_data)
+
+    slots = {
+        category: slot_candidates(items, scores, category)
+        for category in ('Tops', 'Bottoms', 'Dresses & Jumpsuits', 'Outerwear', 'Footwear', 'Accessories')
+    }
+
+    bases = [(top, bottom) for top in slots['Tops'] for bottom in slots['Bottoms']]
+    bases += [(dress,) for dress in slots['Dresses & Jumpsuits']]
+    if not bases:
+        # No top and bottom pair or dress; offer the best single top or bottom
+        singles = slots['Tops'] + slots['Bottoms']
+        bases = [(item,) for item in sorted(singles, key=lambda item: -scores[str(item['_id'])])[:count]]
+
+    if temperature is not None and temperature < COLD and slots['Outerwear']:
+        layers = [(outer,) for outer in slots['Outerwear'][:3]]
+    elif temperature is not None and temperature > HOT:
+        layers = [()]
+    else:
+        layers = [()] + [(outer,) for outer in slots['Outerwear'][:2]]
+
+    shoes = [(shoe,) for shoe in slots['Footwear'][:3]] or [()]
+    extras = [(accessory,) for accessory in slots['Accessories'][:2]] + [()]
+
+    embeddings = {}
+    if RANKER == 'clip':
+        try:
+            embeddings = clip_encoder.item_embeddings(items)
+        except Exception as e:
+            print(f"CLIP embeddings unavailable for outfit scoring: {e}")
+
+    combinations = []
+    for parts in itertools.product(bases, layers, shoes, extras):
+        outfit = [item for part in parts for item in part]
+        if not outfit or len({str(item['_id']) for item in outfit}) < len(outfit):
+            continue
+        score = sum(scores[str(item['_id'])] for item in outfit) / len(outfit)
+        # Reward complete outfits, not just many pieces
+        score += 0.5 * bool(parts[2]) + 0.25 * bool(parts[3])
+        if embeddings:
+            score += compatibility(outfit, embeddings)
+        combinations.append((score, outfit))
+
+    # Highest scoring first, but discourage repeating the same pieces; outfits
+    # that only differ by an accessory count as the same outfit
+    chosen, seen, used = [], set(), {}
+    for _ in range(count):
+        best = None
+        for score, outfit in combinations:
+            if outfit_signature(outfit) in seen:
+                continue
+            adjusted = score - REUSE_PENALTY * sum(used.get(str(item['_id']), 0) for item in outfit) / len(outfit)
+            if best is None or adjusted > best[0]:
+                best = (adjusted, outfit)
+        if best is None:
+            break
+        chosen.append(best[1])
+        seen.add(outfit_signature(best[1]))
+        for item in best[1]:
+            used[str(item['_id'])] = used.get(str(item['_id']), 0) + 1
+
+    return {
+        'outfits': [
+            {
+                'items': [{'id': str(item['_id']), 'category': item['category']} for item in outfit],
+                'styling': styling_tip(outfit, occasion, temperature, condition)
+            }
+            for outfit in chosen
+        ]
+    }
@@ -0,0 +1,140 @@
+"""
+Precomputed outfit suggestions ahead of the morning peak.
+
+Once a day at OUTFIT_PRECOMPUTE_AT (UTC), users active in the last
+PRECOMPUTE_ACTIVE_DAYS days get suggestions for their recent occasions in
+the current weather at their last known location. The results go into the
+outfit suggestion cache under the same key a request would use, so
+/api/outfit-suggestions answers from the cache while the clean clothes and
+the weather band still match. Calls to the model are limited to
+OUTFIT_PRECOMPUTE_CONCURRENCY at a time, so the batch never crowds out
+interactive requests. A batch answer gets OUTFIT_PRECOMPUTE_LLM_BUDGET
+seconds instead of the interactive budget and never falls back to local
+outfits; one that fails is counted as failed and not cached.
+
+The scheduler only runs with OUTFIT_PRECOMPUTE=true. With several app
+processes, the first one to claim a day's run does it. To run a batch by
+hand (e.g. from cron):
+
+    python outfit_precompute.py
+"""
+import os
+import time
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import ReturnDocument
+
+import repository
+from db import collection_versions
+from weather_service import weather_service
+
+PRECOMPUTE_ENABLED = os.environ.get('OUTFIT_PRECOMPUTE', 'false').lower() == 'true'
+PRECOMPUTE_AT = os.environ.get('OUTFIT_PRECOMPUTE_AT', '05:30')  # HH:MM, UTC
+PRECOMPUTE_ACTIVE_DAYS = int(os.environ.get('OUTFIT_PRECOMPUTE_ACTIVE_DAYS', '7'))
+PRECOMPUTE_CONCURRENCY = int(os.environ.get('OUTFIT_PRECOMPUTE_CONCURRENCY', '2'))
+PRECOMPUTE_MAX_USERS = int(os.environ.get('OUTFIT_PRECOMPUTE_MAX_USERS', '5000'))
+# Seconds the model gets per answer; far above OUTFIT_LLM_BUDGET, as nobody is waiting
+PRECOMPUTE_LLM_BUDGET = float(os.environ.get('OUTFIT_PRECOMPUTE_LLM_BUDGET', '120'))
+
+
+def next_run(now, at=PRECOMPUTE_AT):
+    """The next UTC datetime at HH:MM after `now`"""
+    hour, minute = (int(part) for part in at.split(':'))
+    run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return run if run > now else run + datetime.timedelta(days=1)
+
+
+def claim_run(day):
+    """True for the first process to claim the day's batch"""
+    entry = collection_versions.find_one_and_update(
+        {'_id': f'outfit_precompute:{day}'},
+        {'$inc': {'version': 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return entry['version'] == 1
+
+
+class OutfitPrecomputer:
+    """
+    Daily batch of outfit suggestions for active users. `compute(user_id,
+    occasion, weather_data)` generates and caches one set of suggestions,
+    returning False when there was nothing to do and raising when it failed.
+    """
+
+    def __init__(self, compute, concurrency=PRECOMPUTE_CONCURRENCY):
+        self.compute = compute
+        self.concurrency = concurrency
+        self.last_run = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the daily schedule in a background thread (once)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._schedule, name='outfit-precompute', daemon=True)
+                self._thread.start()
+
+    def _schedule(self):
+        while True:
+            run_at = next_run(datetime.datetime.utcnow())
+            time.sleep(max((run_at - datetime.datetime.utcnow()).total_seconds(), 0))
+            try:
+                if claim_run(run_at.date().isoformat()):
+                    self.run_once()
+            except Exception as e:
+                print(f"Outfit precompute run failed: {e}")
+
+    def run_once(self):
+        """Precompute suggestions for every active user's recent occasions; returns the run summary"""
+        started = time.time()
+        since = datetime.datetime.utcnow() - datetime.timedelta(days=PRECOMPUTE_ACTIVE_DAYS)
+        users = repository.active_users(since, PRECOMPUTE_MAX_USERS)
+        summary = {'users': len(users), 'computed': 0, 'skipped': 0, 'failed': 0}
+
+        tasks = [
+            (str(user['_id']), user['last_location'], occasion)
+            for user in users
+            for occasion in user['recent_occasions']
+        ]
+
+        # The pool size is the number of model calls in flight at once
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='outfit-precompute') as pool:
+            for outcome in pool.map(lambda task: self._precompute(*task), tasks):
+                summary[outcome] += 1
+
+        summary['started_at'] = datetime.datetime.utcfromtimestamp(started).isoformat()
+        summary['duration_s'] = round(time.time() - started, 1)
+        self.last_run = summary
+        print(f"Outfit precompute: {summary}")
+        return summary
+
+    def _precompute(self, user_id, location, occasion):
+        try:
+            # Users in the same grid cell share one weather lookup
+            weather_data = weather_service.current(location['lat'], location['lon'])
+            return 'computed' if self.compute(user_id, occasion, weather_data) else 'skipped'
+        except Exception as e:
+            print(f"Could not precompute outfits for user {user_id}: {e}")
+            return 'failed'
+
+    def stats(self):
+        return {
+            'enabled': PRECOMPUTE_ENABLED,
+            'scheduled_at': PRECOMPUTE_AT,
+            'concurrency': self.concurrency,
+            'last_run': self.last_run
+        }
+
+
+def main():
+    # Imported here: the app module builds the outfit pipeline this batch runs
+    from app import outfit_precomputer
+    outfit_precomputer.run_once()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Local pre-ranking of wardrobe items for outfit suggestions.
+
+Rather than sending a whole wardrobe to the model, items are scored against
+the occasion and weather with simple tag rules (or, with
+OUTFIT_RANKER=clip, rules plus CLIP text similarity between the occasion
+and each item's description) and only a bounded shortlist is sent, balanced
+across categories so the model can still build complete outfits. Items are
+encoded compactly with trimmed descriptions.
+"""
+import os
+import re
+import json
+import threading
+
+from db import CLOTHING_CATEGORIES
+
+SHORTLIST_SIZE = int(os.environ.get('OUTFIT_SHORTLIST_SIZE', '24'))
+MIN_PER_CATEGORY = 2  # Keep a few of every category so complete outfits stay possible
+UNSUITABLE_SCORE = -2
+DESCRIPTION_CHARS = 240
+RANKER = os.environ.get('OUTFIT_RANKER', 'rules')
+
+WARM_TAGS = {
+    "Sweater", "Hoodie / Sweatshirt", "Jacket", "Coat", "Cardigan", "Boots", "Scarf",
+    "Jeans", "Trousers / Pants"
+}
+SUMMER_TAGS = {
+    "T-shirt", "Tank top", "Shorts", "Skirt", "Dress", "Sandals", "Sunglasses", "Hat / Cap", "Swimwear"
+}
+RAIN_TAGS = {"Jacket", "Coat", "Boots"}
+WET_CONDITIONS = {'rain', 'drizzle', 'snow', 'thunderstorm'}
+
+# Occasion keywords -> tags that suit that kind of occasion
+OCCASION_STYLES = {
+    'formal': (
+        {'interview', 'wedding', 'office', 'work', 'business', 'formal', 'meeting', 'gala', 'ceremony',
+         'dinner', 'date', 'conference', 'presentation'},
+        {"Shirt / Blouse", "Blazer / Suit jacket", "Trousers / Pants", "Formal shoes", "Dress",
+         "Formalwear / Occasionwear", "Skirt", "Belt", "Jewelry", "Coat"}
+    ),
+    'sport': (
+        {'gym', 'run', 'running', 'workout', 'hike', 'hiking', 'sport', 'sports', 'yoga', 'training',
+         'tennis', 'cycling'},
+        {"Activewear / Sportswear", "Sneakers", "Shorts", "T-shirt", "Tank top", "Hoodie / Sweatshirt", "Hat / Cap"}
+    ),
+    'beach': (
+        {'beach', 'pool', 'swim', 'swimming', 'vacation', 'holiday', 'resort'},
+        {"Swimwear", "Sandals", "Shorts", "Tank top", "Sunglasses", "Hat / Cap", "Dress", "T-shirt"}
+    ),
+    'casual': (
+        {'casual', 'weekend', 'brunch', 'shopping', 'errands', 'coffee', 'friends', 'park', 'school',
+         'class', 'movie', 'concert', 'travel'},
+        {"T-shirt", "Jeans", "Sneakers", "Hoodie / Sweatshirt", "Sweater", "Shorts", "Skirt", "Cardigan",
+         "Bag", "Jacket", "Boots"}
+    ),
+    'lounge': (
+        {'sleep', 'lounge', 'home', 'relax', 'relaxing', 'bed'},
+        {"Sleepwear / Loungewear", "Hoodie / Sweatshirt", "T-shirt"}
+    ),
+}
+# Only suitable when the occasion calls for them
+SPECIAL_TAGS = {
+    "Swimwear": 'beach',
+    "Sleepwear / Loungewear": 'lounge',
+    "Activewear / Sportswear": 'sport',
+    "Formalwear / Occasionwear": 'formal'
+}
+
+
+def words(text):
+    return set(re.findall(r'[a-z]+', str(text).lower()))
+
+
+def weather_signals(weather_data):
+    """(temperature in °C or None, lower-case condition) from an OpenWeatherMap payload"""
+    weather_data = weather_data or {}
+    temperature = (weather_data.get('main') or {}).get('temp')
+    if not isinstance(temperature, (int, float)):
+        temperature = None
+    conditions = weather_data.get('weather') or []
+    condition = str(conditions[0].get('main', '')).lower() if conditions else ''
+    return temperature, condition
+
+
+def occasion_styles(occasion):
+    occasion_words = words(occasion)
+    return {style for style, (keywords, _) in OCCASION_STYLES.items() if occasion_words & keywords}
+
+
+def rule_score(item, occasion_words, styles, temperature, condition):
+    tag = item.get('tag', '')
+    score = 0.0
+
+    if temperature is not None:
+        if temperature < 10:
+            score += 2 if tag in WARM_TAGS else 0
+            score -= 2 if tag in SUMMER_TAGS else 0
+        elif temperature > 24:
+            score += 2 if tag in SUMMER_TAGS else 0
+            score -= 2 if tag in WARM_TAGS and tag not in ("Jeans", "Trousers / Pants") else 0
+
+    if condition in WET_CONDITIONS:
+        score += 1.5 if tag in RAIN_TAGS else 0
+        score -= 1.5 if tag == "Sandals" else 0
+
+    for style in styles:
+        if tag in OCCASION_STYLES[style][1]:
+            score += 2
+
+    if tag in SPECIAL_TAGS and SPECIAL_TAGS[tag] not in styles:
+        score -= 3
+
+    # Descriptions that mention the occasion ("office-ready", "party top")
+    text = f"{item.get('name', '')} {item.get('fit_description', '')} {item.get('ai_description', '')}"
+    score += min(len(occasion_words & words(text)) * 0.5, 1.5)
+
+    return score
+
+
+def item_text(item):
+    """Short description used for embeddings"""
+    return f"{item.get('tag', '')} {item.get('name', '')}. {item.get('ai_description', '')}"[:300]
+
+
+class ClipTextEncoder:
+    """Lazily loaded CLIP text encoder with a per-item embedding cache"""
+
+    def __init__(self, max_cached=5000):
+        self.max_cached = max_cached
+        self._model = None
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._model is None:
+            from clip_index.search_clip import setup_clip_model
+            self._model, _, self._device = setup_clip_model()
+        return self._model
+
+    def encode(self, texts):
+        import clip
+        import torch
+
+        with self._lock:
+            model = self._load()
+            with torch.no_grad():
+                features = model.encode_text(clip.tokenize(texts, truncate=True).to(self._device)).float()
+            features = features / features.norm(dim=-1, keepdim=True)
+            return features.cpu().numpy()
+
+    def item_embeddings(self, items):
+        """{item id: unit vector}; descriptions are cached by id and text"""
+        keys = [(str(item['_id']), item_text(item)) for item in items]
+        missing = [key for key in keys if key not in self._cache]
+        if missing:
+            for key, vector in zip(missing, self.encode([text for _, text in missing])):
+                if len(self._cache) >= self.max_cached:
+                    self._cache.clear()
+                self._cache[key] = vector
+        return {item_id: self._cache[(item_id, text)] for item_id, text in keys}
+
+
+clip_encoder = ClipTextEncoder()
+
+
+def clip_scores(items, occasion, condition):
+    """Cosine similarity of each item to the occasion, standardized across items"""
+    import numpy as np
+
+    query = clip_encoder.encode([f"clothes to wear for {occasion}" + (f" in {condition}" if condition else "")])[0]
+    embeddings = clip_encoder.item_embeddings(items)
+    similarities = np.array([float(embeddings[str(item['_id'])] @ query) for item in items])
+    spread = similarities.std() or 1.0
+    return dict(zip((str(item['_id']) for item in items), (similarities - similarities.mean()) / spread))
+
+
+def score_items(items, occasion, weather_data):
+    """{item id: suitability score} for the occasion and weather"""
+    temperature, condition = weather_signals(weather_data)
+    occasion_words = words(occasion)
+    styles = occasion_styles(occasion)
+
+    scores = {
+        str(item['_id']): rule_score(item, occasion_words, styles, temperature, condition)
+        for item in items
+    }
+
+    if RANKER == 'clip':
+        try:
+            for item_id, similarity in clip_scores(items, occasion, condition).items():
+                scores[item_id] += similarity
+        except Exception as e:
+            print(f"CLIP ranking unavailable, using rules only: {e}")
+
+    return scores
+
+
+def shortlist(items, occasion, weather_data, limit=SHORTLIST_SIZE):
+    """
+    The best `limit` items for the occasion and weather, keeping at least
+    MIN_PER_CATEGORY of every category present (when the limit allows).
+    """
+    if len(items) <= limit:
+        return list(items)
+
+    scores = score_items(items, occasion, weather_data)
+    ranked = sorted(items, key=lambda item: scores[str(item['_id'])], reverse=True)
+
+    by_category = {}
+    for item in ranked:
+        # Clearly unsuitable items (swimwear to an interview) get no reserved place
+        if scores[str(item['_id'])] > UNSUITABLE_SCORE:
+            by_category.setdefault(item.get('category'), []).append(item)
+
+    per_category = max(1, min(MIN_PER_CATEGORY, limit // max(len(by_category), 1)))
+    chosen = []
+    for category in CLOTHING_CATEGORIES:
+        chosen.extend(by_category.get(category, [])[:per_category])
+    chosen = chosen[:limit]
+
+    chosen_ids = {id(item) for item in chosen}
+    for item in ranked:
+        if len(chosen) >= limit:
+            break
+        if id(item) not in chosen_ids:
+            chosen.append(item)
+
+    return chosen
+
+
+def compact_items(items):
+    """Items as compact JSON for the prompt, with trimmed descriptions"""
+    encoded = []
+    for item in items:
+        entry = {'id': str(item['_id']), 'category': item['category'], 'tag': item['tag']}
+        if item.get('name'):
+            entry['name'] = item['name']
+        if item.get('fit_description'):
+            entry['fit'] = item['fit_description'][:DESCRIPTION_CHARS]
+        if item.get('ai_description'):
+            description = ' '.join(item['ai_description'].split())
+            entry['desc'] = description[:DESCRIPTION_CHARS]
+        encoded.append(entry)
+    return json.dumps(encoded, separators=(',', ':'), ensure_ascii=False)
+
+
+def count_tokens(text):
+    """Prompt tokens, exact with tiktoken installed and estimated (~4 chars per token) otherwise"""
+    try:
+        import tiktoken
+        return len(tiktoken.get_encoding('o200k_base').encode(text))
+    except ImportError:
+        return len(text) // 4
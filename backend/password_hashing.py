@@ -0,0 +1,145 @@
+"""
+Password hashing off the request threads.
+
+bcrypt is deliberately slow and CPU-bound; run inline, a burst of logins
+holds every Flask worker and the GIL while unrelated requests wait. Hashes
+and checks are instead sent to a small process pool. Admission is bounded:
+when PASSWORD_HASH_MAX_PENDING operations are already queued or running, new
+ones are refused with PasswordHashingBusy (the routes answer 503) instead of
+piling up behind the pool. An operation that times out or hits a crashed
+worker is reported the same way.
+
+Workers are started by a fork server that only preloads this module: forking
+the app itself is unsafe once it runs threads (the Mongo client's, the worker
+pools'). The app module must therefore be safe to import again as
+__mp_main__, which it is when run directly.
+"""
+import os
+import time
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from flask_bcrypt import generate_password_hash, check_password_hash
+
+HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', str(min(2, os.cpu_count() or 1))))
+HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', str(HASH_WORKERS * 8)))
+HASH_ADMISSION_TIMEOUT = float(os.environ.get('PASSWORD_HASH_ADMISSION_TIMEOUT', '0.5'))
+HASH_TIMEOUT = 30
+LATENCY_SAMPLES = 500
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when a hash operation cannot be run now: too many waiting, too slow, or a worker crashed"""
+
+
+def _pool_context():
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def _hash_password(password):
+    started = time.time()
+    return generate_password_hash(password).decode('utf-8'), started
+
+
+def _check_password(pw_hash, password):
+    started = time.time()
+    return check_password_hash(pw_hash, password), started
+
+
+class PasswordHasher:
+    def __init__(self, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING,
+                 admission_timeout=HASH_ADMISSION_TIMEOUT):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.admission_timeout = admission_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._lock = threading.Lock()
+
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.failed = 0
+        self.pending = 0
+        self.queue_waits = deque(maxlen=LATENCY_SAMPLES)
+        self.durations = deque(maxlen=LATENCY_SAMPLES)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_pool_context())
+            return self._pool
+
+    def hash(self, password):
+        return self._run(_hash_password, password)
+
+    def check(self, pw_hash, password):
+        return self._run(_check_password, pw_hash, password)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.admission_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHashingBusy("Too many sign-ins in progress, please retry shortly")
+
+        submitted = time.time()
+        with self._lock:
+            self.pending += 1
+        pool = self._get_pool()
+        try:
+            future = pool.submit(fn, *args)
+            result, started = future.result(timeout=HASH_TIMEOUT)
+        except FutureTimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise PasswordHashingBusy("Sign-in is taking too long, please retry shortly")
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next caller
+            with self._lock:
+                self.failed += 1
+                if self._pool is pool:
+                    self._pool = None
+            raise PasswordHashingBusy("Sign-in is temporarily unavailable, please retry shortly")
+        finally:
+            with self._lock:
+                self.pending -= 1
+            self._slots.release()
+
+        finished = time.time()
+        with self._lock:
+            self.completed += 1
+            self.queue_waits.append(max(started - submitted, 0))
+            self.durations.append(finished - submitted)
+        return result
+
+    def stats(self):
+        with self._lock:
+            data = {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self.pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'failed': self.failed
+            }
+            for name, samples in (('queue_wait_ms', self.queue_waits), ('latency_ms', self.durations)):
+                ordered = sorted(samples)
+                if ordered:
+                    data[name] = {
+                        'p50': round(ordered[len(ordered) // 2] * 1000, 1),
+                        'p95': round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000, 1),
+                        'max': round(ordered[-1] * 1000, 1)
+                    }
+            return data
+
+
+password_hasher = PasswordHasher()
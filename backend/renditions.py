@@ -0,0 +1,111 @@
+"""
+Smaller renditions of stored images for grid and card views.
+
+When an image is stored, a background pool renders a thumbnail and a medium
+copy of it into the blob store and records their ids in the image_renditions
+collection. /api/images/<image_id>/<size> serves a rendition, falling back to
+the original (and queueing the work) when it has not been rendered yet.
+"""
+import io
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps, features
+
+from db import image_renditions
+from blob_store import get_blob, put_blob, image_url, is_image_id
+
+# Longest side in pixels for each rendition
+SIZES = {
+    'thumb': 256,
+    'medium': 768
+}
+RENDITION_WORKERS = int(os.environ.get('RENDITION_WORKERS', '2'))
+
+# Prefer WebP where Pillow was built with it
+if features.check('webp'):
+    RENDITION_FORMAT, RENDITION_MIME = 'WEBP', 'image/webp'
+else:
+    RENDITION_FORMAT, RENDITION_MIME = 'JPEG', 'image/jpeg'
+
+_pool = ThreadPoolExecutor(max_workers=RENDITION_WORKERS, thread_name_prefix='renditions')
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def schedule_renditions(image_id):
+    """Queue rendition generation for a stored image (no-op if already queued)"""
+    if not is_image_id(image_id):
+        return
+
+    with _pending_lock:
+        if image_id in _pending:
+            return
+        _pending.add(image_id)
+
+    _pool.submit(_render, image_id)
+
+
+def get_rendition(image_id, size):
+    """Return the blob id of a rendition, or None if it does not exist yet"""
+    entry = image_renditions.find_one({'_id': image_id}, {size: 1})
+    return entry.get(size) if entry else None
+
+
+def rendition_url(image_id, size, user_id):
+    return image_url(image_id, user_id, size)
+
+
+def doc_rendition_urls(doc, ids_field, size, user_id):
+    """
+    Rendition URLs for a user's document's images. Documents not yet migrated
+    have none; their inline images are already in the response once.
+    """
+    return [rendition_url(image_id, size, user_id) for image_id in doc.get(ids_field) or []]
+
+
+def doc_rendition_url(doc, id_field, size, user_id):
+    if doc.get(id_field):
+        return rendition_url(doc[id_field], size, user_id)
+    return None
+
+
+def render(data, max_side):
+    """Encode a downscaled copy of image bytes"""
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    output = io.BytesIO()
+    if RENDITION_FORMAT == 'WEBP':
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        image.save(output, 'WEBP', quality=80, method=4)
+    else:
+        image.convert('RGB').save(output, 'JPEG', quality=80, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def _render(image_id):
+    try:
+        if image_renditions.find_one({'_id': image_id}, {'_id': 1}):
+            return
+
+        blob = get_blob(image_id)
+        if blob is None:
+            return
+
+        data = blob[0]
+        entry = {'created_at': time.time()}
+        for size, max_side in SIZES.items():
+            entry[size] = put_blob(render(data, max_side), RENDITION_MIME)
+
+        image_renditions.update_one({'_id': image_id}, {'$set': entry}, upsert=True)
+
+    except Exception as e:
+        print(f"Error rendering image {image_id}: {e}")
+
+    finally:
+        with _pending_lock:
+            _pending.discard(image_id)
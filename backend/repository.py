@@ -0,0 +1,292 @@
+"""
+Data access for users, photos, wardrobe items and try-on history.
+
+Every read names the fields its view needs, so image payloads and AI
+descriptions are only loaded where they are used. Ownership is part of the
+query filter rather than a separate lookup, and updates return the updated
+document from the same round-trip. Writes to a user's lists bump the
+version the HTTP cache tags those lists with.
+"""
+import time
+import datetime
+
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument, DESCENDING
+
+from db import users, user_photos, wardrobe_items, try_on_history
+from http_cache import bump_version
+from outfit_cache import suggestion_cache
+
+# Projections, one per view. Legacy inline image fields are included so
+# documents the image migration has not reached yet still render.
+USER_FIELDS = {'email': 1, 'name': 1}
+PRECOMPUTE_USER_FIELDS = {'last_location': 1, 'recent_occasions': 1}
+PHOTO_LIST_FIELDS = {'name': 1, 'image_id': 1, 'image': 1, 'created_at': 1}
+PHOTO_IMAGE_FIELDS = {'image_id': 1, 'image': 1}
+WARDROBE_LIST_FIELDS = {
+    'name': 1, 'fit_description': 1, 'category': 1, 'tag': 1, 'color': 1,
+    'in_laundry': 1, 'unavailable': 1, 'created_at': 1, 'updated_at': 1,
+    'image_ids': 1, 'images': 1, 'ai_description_status': 1
+}
+WARDROBE_EDIT_FIELDS = dict(WARDROBE_LIST_FIELDS, ai_description=1)
+WARDROBE_STATUS_FIELDS = {'in_laundry': 1, 'unavailable': 1, 'updated_at': 1}
+WARDROBE_DESCRIPTION_FIELDS = {'ai_description': 1, 'ai_description_status': 1, 'ai_description_attempts': 1}
+# Outfit suggestions read every available item, so no inline images here;
+# the few chosen items without image_ids are read again for theirs
+WARDROBE_OUTFIT_FIELDS = {
+    'name': 1, 'category': 1, 'tag': 1, 'ai_description': 1, 'fit_description': 1,
+    'image_ids': 1
+}
+# Records made before the blob store carry the garment inline until
+# migrate_images.py moves it; reads never convert them
+HISTORY_LIST_FIELDS = {
+    'result_image': 1, 'garment_image_id': 1, 'garment_image': 1, 'prediction_id': 1, 'created_at': 1
+}
+
+RECENT_OCCASIONS = 3  # Occasions remembered per user for outfit precomputation
+ACTIVITY_RESOLUTION = datetime.timedelta(hours=1)  # How stale last_active_at may get before weather lookups refresh it
+
+
+def object_id(value):
+    """Parse an id from a URL or form, returning None if it is not a valid ObjectId"""
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+
+def _wardrobe_changed(user_id):
+    # Cached wardrobe lists and outfit suggestions are now stale
+    bump_version(user_id, 'wardrobe')
+    suggestion_cache.invalidate(user_id)
+
+
+def _owned(user_id, doc_id):
+    """Filter matching one document of a user's, or None if the id is malformed"""
+    oid = object_id(doc_id)
+    if oid is None:
+        return None
+    return {'_id': oid, 'user_id': str(user_id)}
+
+
+# Users
+
+def get_user(user_id, projection=USER_FIELDS):
+    oid = object_id(user_id)
+    return users.find_one({'_id': oid}, projection) if oid else None
+
+
+def record_location(user_id, lat, lon):
+    """
+    Remember where the user last asked for the weather (a grid cell, not exact
+    coordinates). Only writes when the cell changed, or to refresh an activity
+    time older than ACTIVITY_RESOLUTION.
+    """
+    location = {'lat': lat, 'lon': lon}
+    now = datetime.datetime.utcnow()
+    users.update_one(
+        {
+            '_id': ObjectId(user_id),
+            '$or': [
+                {'last_location': {'$ne': location}},
+                {'last_active_at': {'$not': {'$gte': now - ACTIVITY_RESOLUTION}}}
+            ]
+        },
+        {'$set': {'last_location': location, 'last_active_at': now}}
+    )
+
+
+def record_occasion(user_id, occasion, keep=RECENT_OCCASIONS):
+    """Keep the user's `keep` most recent distinct outfit occasions, newest last"""
+    # One pipeline update, so concurrent requests cannot interleave a pull and
+    # a push; $literal keeps an occasion starting with '$' from being read as a field
+    users.update_one({'_id': ObjectId(user_id)}, [{'$set': {
+        'recent_occasions': {'$slice': [
+            {'$concatArrays': [
+                {'$filter': {
+                    'input': {'$ifNull': ['$recent_occasions', []]},
+                    'cond': {'$ne': ['$$this', {'$literal': occasion}]}
+                }},
+                {'$literal': [occasion]}
+            ]},
+            -keep
+        ]},
+        'last_active_at': datetime.datetime.utcnow()
+    }}])
+
+
+def active_users(since, limit, projection=PRECOMPUTE_USER_FIELDS):
+    """Users active since `since` whose location and occasions are known"""
+    return list(users.find(
+        {'last_active_at': {'$gte': since}, 'last_location': {'$exists': True}, 'recent_occasions.0': {'$exists': True}},
+        projection
+    ).sort('last_active_at', DESCENDING).limit(limit))
+
+
+# Photos
+
+def list_photos(user_id):
+    return list(
+        user_photos.find({'user_id': str(user_id)}, PHOTO_LIST_FIELDS).sort('created_at', DESCENDING)
+    )
+
+
+def get_photo(user_id, photo_id, projection=PHOTO_IMAGE_FIELDS):
+    query = _owned(user_id, photo_id)
+    return user_photos.find_one(query, projection) if query else None
+
+
+def add_photo(user_id, photo):
+    photo['user_id'] = str(user_id)
+    result = user_photos.insert_one(photo)
+    bump_version(user_id, 'photos')
+    return result.inserted_id
+
+
+def delete_photo(user_id, photo_id):
+    """Delete one of the user's photos; returns False if there was no such photo"""
+    query = _owned(user_id, photo_id)
+    if not query or not user_photos.delete_one(query).deleted_count:
+        return False
+    bump_version(user_id, 'photos')
+    return True
+
+
+# Wardrobe
+
+def list_wardrobe(user_id, projection=WARDROBE_LIST_FIELDS):
+    return list(
+        wardrobe_items.find({'user_id': str(user_id)}, projection).sort('created_at', DESCENDING)
+    )
+
+
+def available_wardrobe(user_id, projection=WARDROBE_OUTFIT_FIELDS):
+    """Items that are neither in the laundry nor marked unavailable"""
+    return list(wardrobe_items.find(
+        {'user_id': str(user_id), 'in_laundry': False, 'unavailable': False},
+        projection
+    ))
+
+
+def get_wardrobe_item(user_id, item_id, projection=WARDROBE_EDIT_FIELDS):
+    query = _owned(user_id, item_id)
+    return wardrobe_items.find_one(query, projection) if query else None
+
+
+def find_wardrobe_items(user_id, item_ids, projection):
+    """The user's items among `item_ids`; ids that are malformed or not theirs are left out"""
+    oids = [oid for oid in map(object_id, item_ids) if oid is not None]
+    return list(wardrobe_items.find({'_id': {'$in': oids}, 'user_id': str(user_id)}, projection))
+
+
+def add_wardrobe_item(user_id, item):
+    item['user_id'] = str(user_id)
+    result = wardrobe_items.insert_one(item)
+    _wardrobe_changed(user_id)
+    return result.inserted_id
+
+
+def update_wardrobe_item(user_id, item_id, fields, unset=None, projection=WARDROBE_LIST_FIELDS):
+    """Set `fields` on one of the user's items and return the updated item, or None if not found"""
+    query = _owned(user_id, item_id)
+    if not query:
+        return None
+
+    update = {'$set': fields}
+    if unset:
+        update['$unset'] = {field: '' for field in unset}
+
+    item = wardrobe_items.find_one_and_update(
+        query, update, projection=projection, return_document=ReturnDocument.AFTER
+    )
+    if item:
+        _wardrobe_changed(user_id)
+    return item
+
+
+def set_wardrobe_description(user_id, item_id, image_ids, fields):
+    """
+    Set description fields on an item, but only while it still has the
+    images they describe (in any order); returns whether the item was updated.
+    """
+    result = wardrobe_items.update_one(
+        {
+            '_id': ObjectId(item_id),
+            'user_id': str(user_id),
+            'image_ids': {'$all': image_ids, '$size': len(image_ids)}
+        },
+        {'$set': fields}
+    )
+    if result.modified_count:
+        _wardrobe_changed(user_id)
+    return result.matched_count > 0
+
+
+def unfinished_descriptions(user_id, projection=WARDROBE_DESCRIPTION_FIELDS):
+    """The user's items whose AI description is pending or failed"""
+    return list(wardrobe_items.find(
+        {'user_id': str(user_id), 'ai_description_status': {'$in': ['pending', 'failed']}},
+        projection
+    ))
+
+
+def stale_descriptions(requested_before, limit=500):
+    """Items still waiting for a description requested before the given time"""
+    return list(wardrobe_items.find(
+        {'ai_description_status': 'pending', 'ai_description_requested_at': {'$lt': requested_before}},
+        {'ai_description_requested_at': 1}
+    ).limit(limit))
+
+
+def claim_stale_description(item_id, requested_at):
+    """
+    Take over a stale pending description by moving its request time to now.
+    Returns the item (user_id, image_ids) to the one caller whose claim
+    succeeded, None to everyone else.
+    """
+    return wardrobe_items.find_one_and_update(
+        {'_id': item_id, 'ai_description_status': 'pending', 'ai_description_requested_at': requested_at},
+        {'$set': {'ai_description_requested_at': time.time()}},
+        projection={'user_id': 1, 'image_ids': 1},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def delete_wardrobe_item(user_id, item_id):
+    """Delete one of the user's items; returns False if there was no such item"""
+    query = _owned(user_id, item_id)
+    if not query or not wardrobe_items.delete_one(query).deleted_count:
+        return False
+    _wardrobe_changed(user_id)
+    return True
+
+
+# Try-on history
+
+def history_page(user_id, limit, after=None):
+    """
+    One page of history, newest first. `after` is the (created_at, _id) of the
+    last record of the previous page. Returns (records, has_more).
+    """
+    query = {'user_id': str(user_id)}
+    if after:
+        created_at, last_id = after
+        query['$or'] = [
+            {'created_at': {'$lt': created_at}},
+            {'created_at': created_at, '_id': {'$lt': last_id}}
+        ]
+
+    # Fetch one extra record to learn whether another page follows
+    records = list(
+        try_on_history.find(query, HISTORY_LIST_FIELDS)
+        .sort([('created_at', DESCENDING), ('_id', DESCENDING)])
+        .limit(limit + 1)
+    )
+    return records[:limit], len(records) > limit
+
+
+def add_history(record):
+    result = try_on_history.insert_one(record)
+    bump_version(record['user_id'], 'history')
+    return result.inserted_id
@@ -1,26 +1,21 @@
-import requests
 import os
 import base64
 from dotenv import load_dotenv
 from PIL import Image
 import pillow_heif
-from openai import OpenAI
+from http_clients import openai_api, get_openai_client
+from weather_service import weather_service, WeatherUnavailable
 
 load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY)
 
-def get_location():
-    ip_info = requests.get("http://ip-api.com/json/").json()
-    return ip_info['city'], ip_info['lat'], ip_info['lon']
+def get_location(ip=None):
+    return weather_service.locate(ip)
 
 def get_weather(lat, lon):
-    api_key = os.environ.get("OPENWEATHER_API_KEY", "")
-    url = f"http://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={api_key}&units=metric"
-    response = requests.get(url).json()
-
-    if response.get("cod") != 200:
-        print("Weather API Error:", response.get("message"))
+    try:
+        response = weather_service.current(lat, lon)
+    except WeatherUnavailable as e:
+        print("Weather API Error:", e.details)
         return None
 
     return {
@@ -57,7 +52,8 @@ def classify_with_gpt_vision(img_path):
     city, lat, lon = get_location()
     weather_data = get_weather(lat, lon)
 
-    response = client.chat.completions.create(
+    response = openai_api.call(
+        get_openai_client().chat.completions.create,
         model="gpt-4o",
         messages = [
             {
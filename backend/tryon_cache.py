@@ -0,0 +1,98 @@
+"""
+Content-addressed cache of try-on results.
+
+A try-on is keyed by the SHA-256 of the model image bytes, the garment image
+bytes and the category, so rerunning the exact same pair is served from a
+previous Fashn result instead of a new paid prediction.
+"""
+import os
+import time
+import hashlib
+import datetime
+import threading
+
+from db import try_on_cache
+from images import decode_data_uri
+
+CACHE_TTL = int(os.environ.get('TRY_ON_CACHE_TTL', str(7 * 24 * 3600)))  # Fashn result URLs are not permanent
+
+
+def image_digest(image):
+    return hashlib.sha256(decode_data_uri(image)).digest()
+
+
+def cache_key(model_image, garment_image, category='auto', model_digest=None):
+    """Cache key for a try-on; pass `model_digest` to avoid rehashing a shared model image"""
+    digest = hashlib.sha256()
+    digest.update(model_digest or image_digest(model_image))
+    digest.update(image_digest(garment_image))
+    digest.update(category.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class TryOnCache:
+    """Persistent try-on results with in-process hit-rate counters"""
+
+    def __init__(self, collection=try_on_cache, ttl=CACHE_TTL):
+        self.collection = collection
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached result for a key, or None"""
+        try:
+            entry = self.collection.find_one_and_update(
+                {'_id': key, 'expires_at': {'$gt': time.time()}},
+                {'$inc': {'hits': 1}}
+            )
+        except Exception as e:
+            print(f"Try-on cache lookup failed: {e}")
+            entry = None
+
+        with self._lock:
+            if entry:
+                self.hits += 1
+                self.saved_seconds += entry.get('duration', 0)
+            else:
+                self.misses += 1
+
+        return entry
+
+    def put(self, key, result_image, prediction_id, duration):
+        now = time.time()
+        try:
+            self.collection.update_one(
+                {'_id': key},
+                {
+                    '$set': {
+                        'result_image': result_image,
+                        'prediction_id': prediction_id,
+                        'duration': duration,
+                        'created_at': now,
+                        'expires_at': now + self.ttl,
+                        # Date copy of expires_at for the TTL index, which ignores numbers
+                        'purge_at': datetime.datetime.utcfromtimestamp(now + self.ttl)
+                    },
+                    '$setOnInsert': {'hits': 0}
+                },
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Try-on cache write failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'saved_upstream_seconds': round(self.saved_seconds, 1)
+            }
+
+
+# Shared cache used by the try-on job manager
+result_cache = TryOnCache()
@@ -0,0 +1,485 @@
+"""
+Background try-on job queue.
+
+Try-on requests are handed to a small pool that submits them to Fashn, and a
+single poller thread tracks every in-flight prediction. Request threads only
+enqueue a job and return its id; clients fetch progress through the job
+status endpoint or watch its state transitions as they happen. Watchers
+never touch Fashn themselves, so any number of them share the one upstream
+poll per prediction.
+"""
+import os
+import time
+import uuid
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from http_clients import fashn, UpstreamError
+from adaptive_polling import AdaptivePollPolicy, PollingStats
+from tryon_cache import result_cache, cache_key, image_digest
+from blob_store import store_image, image_url
+from renditions import schedule_renditions
+from repository import add_history
+
+# Fashn API settings
+BASE_URL = "https://api.fashn.ai/v1"
+API_KEY = os.environ.get('FASHN_AI_API_KEY', '')  # Get API key from environment variable
+MAX_POLLING_TIME = 120  # Maximum time a prediction may take, in seconds
+POLLING_INTERVAL = 2  # Retry delay when a status check is refused locally
+# Longest a job may wait behind the user's other predictions before it is dropped
+QUEUE_TIMEOUT = int(os.environ.get('TRY_ON_QUEUE_TIMEOUT', '300'))
+
+# Worker settings
+SUBMIT_WORKERS = int(os.environ.get('TRY_ON_SUBMIT_WORKERS', '4'))
+POLL_WORKERS = int(os.environ.get('TRY_ON_POLL_WORKERS', '4'))
+USER_CONCURRENCY = int(os.environ.get('TRY_ON_USER_CONCURRENCY', '3'))  # In-flight predictions per user
+JOB_RETENTION = 15 * 60  # Seconds a finished job stays available for status lookups
+IDLE_WAIT = 30  # Poller sleep when nothing is in flight
+WATCH_HEARTBEAT = 15  # Seconds between keep-alives sent to idle watchers
+# Each watcher holds a request thread; streams end after this many seconds and
+# clients reconnect (or fall back to the status endpoint) for the rest
+WATCH_MAX_DURATION = int(os.environ.get('TRY_ON_WATCH_MAX_DURATION', '25'))
+
+UPSTREAM_PENDING_STATUSES = ('starting', 'in_queue', 'processing')
+FINISHED_STATUSES = ('completed', 'failed', 'timeout')
+
+
+class TryOnJob:
+    """A single try-on request and the state of its Fashn prediction"""
+
+    def __init__(self, user_id, model_image, garment_image, category='auto'):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.model_image = model_image
+        self.garment_image = garment_image
+        self.category = category
+        self.status = 'queued'
+        self.prediction_id = None
+        self.result_image = None
+        self.error = None
+        self.details = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.next_poll_at = None
+        self.polling = False
+        self.version = 0
+        self.model_image_id = None
+        self.garment_image_id = None
+        self.cache_key = None
+        self.cached = False
+        self.holds_slot = False
+
+        # Polling bookkeeping
+        self.submitted_at = None
+        self.active_since = None
+        self.last_delay = None
+        self.last_poll_at = None
+        self.polls = 0
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self):
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'prediction_id': self.prediction_id,
+            'cached': self.cached,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
+        }
+
+        if self.status == 'completed':
+            data['result_image'] = self.result_image
+            data['garment_image'] = image_url(self.garment_image_id, self.user_id) if self.garment_image_id else self.garment_image
+
+        if self.error:
+            data['error'] = self.error
+            if self.details:
+                data['details'] = self.details
+
+        return data
+
+
+class TryOnJobManager:
+    """Submits try-on jobs to Fashn and polls all open predictions from one thread"""
+
+    def __init__(self, submit_workers=SUBMIT_WORKERS, poll_workers=POLL_WORKERS, user_concurrency=USER_CONCURRENCY):
+        self.user_concurrency = user_concurrency
+        self._jobs = {}
+        self._active_by_user = {}
+        self._waiting_by_user = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._wakeup = threading.Event()
+        self._submit_pool = ThreadPoolExecutor(max_workers=submit_workers, thread_name_prefix='tryon-submit')
+        self._poll_pool = ThreadPoolExecutor(max_workers=poll_workers, thread_name_prefix='tryon-poll')
+        self._poller = None
+        self.poll_policy = AdaptivePollPolicy()
+        self.polling_stats = PollingStats()
+
+    def submit(self, user_id, model_image, garment_image, category='auto', model_digest=None):
+        """Queue a try-on and return a snapshot of the new job"""
+        job = TryOnJob(user_id, model_image, garment_image, category)
+
+        try:
+            job.cache_key = cache_key(model_image, garment_image, category, model_digest)
+        except Exception as e:
+            print(f"Could not compute try-on cache key: {e}")
+
+        cached = result_cache.get(job.cache_key) if job.cache_key else None
+
+        with self._lock:
+            self._jobs[job.id] = job
+            if not cached:
+                self._ensure_poller()
+                self._dispatch(job)
+
+        if cached:
+            # Same photo and garment as an earlier run; reuse its result
+            job.cached = True
+            job.prediction_id = cached.get('prediction_id')
+            self._complete(job, cached['result_image'])
+
+        with self._lock:
+            return job.to_dict()
+
+    def submit_batch(self, user_id, model_image, garments):
+        """
+        Queue one try-on per (garment_image, category) pair against the same
+        model image. The model image is decoded and hashed once for all of them.
+        """
+        try:
+            model_digest = image_digest(model_image)
+        except Exception as e:
+            print(f"Could not hash batch model image: {e}")
+            model_digest = None
+
+        return [
+            self.submit(user_id, model_image, garment_image, category, model_digest)
+            for garment_image, category in garments
+        ]
+
+    def get_status(self, job_id, user_id):
+        """Return a snapshot of a job owned by the user, or None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.user_id != user_id:
+                return None
+            return job.to_dict()
+
+    def watch(self, job_id, user_id, heartbeat=WATCH_HEARTBEAT, max_duration=WATCH_MAX_DURATION):
+        """
+        Yield a snapshot of the job each time its status changes, ending once
+        it finishes or after `max_duration` seconds. Yields None after
+        `heartbeat` seconds without a change so callers can keep their
+        connection alive.
+        """
+        return self.watch_many([job_id], user_id, heartbeat, max_duration)
+
+    def watch_many(self, job_ids, user_id, heartbeat=WATCH_HEARTBEAT, max_duration=WATCH_MAX_DURATION):
+        """Like watch(), over several jobs at once; ends when all of them finish or time runs out"""
+        seen = {}
+        pending = set(job_ids)
+        deadline = time.time() + max_duration
+
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+
+            with self._changed:
+                changes = self._collect_changes(pending, user_id, seen)
+                if changes is not None and not changes:
+                    self._changed.wait(min(heartbeat, remaining))
+                    changes = self._collect_changes(pending, user_id, seen)
+
+            if changes is None:
+                return
+
+            if not changes:
+                yield None
+                continue
+
+            for snapshot in changes:
+                if snapshot['status'] in FINISHED_STATUSES:
+                    pending.discard(snapshot['job_id'])
+                yield snapshot
+
+    def _collect_changes(self, job_ids, user_id, seen):
+        # Callers must hold self._lock. Returns None once any job is gone.
+        changes = []
+        for job_id in job_ids:
+            job = self._jobs.get(job_id)
+            if job is None or job.user_id != user_id:
+                return None
+
+            if seen.get(job_id) != job.version:
+                seen[job_id] = job.version
+                changes.append(job.to_dict())
+
+        return changes
+
+    def _dispatch(self, job):
+        # Callers must hold self._lock. Start the job now or park it behind
+        # the user's other in-flight predictions.
+        active = self._active_by_user.get(job.user_id, 0)
+        if active < self.user_concurrency:
+            self._active_by_user[job.user_id] = active + 1
+            job.holds_slot = True
+            self._submit_pool.submit(self._start_prediction, job)
+        else:
+            self._waiting_by_user.setdefault(job.user_id, deque()).append(job)
+            # Let the poller schedule the parked job's queue timeout
+            self._wakeup.set()
+
+    def _release_slot(self, job):
+        # Callers must hold self._lock
+        job.holds_slot = False
+        remaining = self._active_by_user.get(job.user_id, 1) - 1
+        if remaining:
+            self._active_by_user[job.user_id] = remaining
+        else:
+            self._active_by_user.pop(job.user_id, None)
+
+        waiting = self._waiting_by_user.get(job.user_id)
+        if waiting:
+            self._dispatch(waiting.popleft())
+            if not waiting:
+                del self._waiting_by_user[job.user_id]
+
+    def _ensure_poller(self):
+        # Started lazily so importing the module never spawns threads
+        if self._poller is None or not self._poller.is_alive():
+            self._poller = threading.Thread(target=self._poll_loop, name='tryon-poller', daemon=True)
+            self._poller.start()
+
+    def _set_status(self, job, status, **fields):
+        # Callers must hold self._lock
+        changed = status != job.status
+        job.status = status
+        for key, value in fields.items():
+            setattr(job, key, value)
+        job.updated_at = time.time()
+
+        if changed:
+            job.version += 1
+            self._changed.notify_all()
+
+        if job.finished and job.holds_slot:
+            self._release_slot(job)
+
+    def _fail(self, job, status, error, details=None):
+        with self._lock:
+            self._set_status(job, status, error=error, details=details)
+            job.model_image = job.garment_image = None
+        print(f"Try-on job {job.id} {status}: {error}")
+
+    def _start_prediction(self, job):
+        try:
+            run_response = fashn.post(
+                f"{BASE_URL}/run",
+                headers=_headers(),
+                json={
+                    "model_image": job.model_image,
+                    "garment_image": job.garment_image,
+                    "category": job.category,
+                },
+                timeout=30  # 30 seconds timeout for initial request
+            )
+
+            if run_response.status_code != 200:
+                self._fail(job, 'failed', f'API request failed with status code {run_response.status_code}', run_response.text)
+                return
+
+            prediction_id = run_response.json().get("id")
+            if not prediction_id:
+                self._fail(job, 'failed', 'Failed to get prediction ID from API response')
+                return
+
+        except Exception as e:
+            self._fail(job, 'failed', f'API request failed: {str(e)}')
+            return
+
+        now = time.time()
+        delay = self.poll_policy.first_delay()
+        with self._lock:
+            self._set_status(
+                job, 'starting',
+                prediction_id=prediction_id,
+                submitted_at=now,
+                active_since=now,
+                last_delay=delay,
+                next_poll_at=now + delay
+            )
+        self._wakeup.set()
+
+    def _poll_loop(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            due = []
+            next_wakeup = None
+            timed_out = []
+            expired = []
+
+            with self._lock:
+                for job in list(self._jobs.values()):
+                    if job.finished:
+                        if now - job.updated_at > JOB_RETENTION:
+                            del self._jobs[job.id]
+                        continue
+
+                    if job.prediction_id is None and not job.holds_slot:
+                        # Parked behind the user's other predictions
+                        queue_deadline = job.created_at + QUEUE_TIMEOUT
+                        if now > queue_deadline:
+                            expired.append(job)
+                        elif next_wakeup is None or queue_deadline < next_wakeup:
+                            next_wakeup = queue_deadline
+                        continue
+
+                    if job.prediction_id is None or job.polling:
+                        continue
+
+                    if now - job.submitted_at > MAX_POLLING_TIME:
+                        timed_out.append(job)
+                        continue
+
+                    if job.next_poll_at <= now:
+                        job.polling = True
+                        due.append(job)
+                    elif next_wakeup is None or job.next_poll_at < next_wakeup:
+                        next_wakeup = job.next_poll_at
+
+            for job in timed_out:
+                self._fail(job, 'timeout', f'Prediction timed out after {MAX_POLLING_TIME} seconds')
+
+            for job in expired:
+                with self._lock:
+                    waiting = self._waiting_by_user.get(job.user_id)
+                    if waiting and job in waiting:
+                        waiting.remove(job)
+                        if not waiting:
+                            del self._waiting_by_user[job.user_id]
+                    else:
+                        # Dispatched in the meantime
+                        continue
+                self._fail(job, 'timeout', f'Waited more than {QUEUE_TIMEOUT} seconds for a free try-on slot')
+
+            for job in due:
+                self._poll_pool.submit(self._poll_status, job)
+
+            timeout = IDLE_WAIT if next_wakeup is None else max(0, next_wakeup - now)
+            self._wakeup.wait(timeout)
+
+    def _poll_status(self, job):
+        try:
+            poll_started = time.time()
+            status_response = fashn.get(
+                f"{BASE_URL}/status/{job.prediction_id}",
+                headers=_headers(),
+                timeout=10
+            )
+
+            if status_response.status_code != 200:
+                self._fail(job, 'failed', f'Status check failed with status code {status_response.status_code}', status_response.text)
+                return
+
+            status_data = status_response.json()
+            status = status_data.get("status")
+
+            with self._lock:
+                job.polls += 1
+                previous_poll_at = job.last_poll_at or job.submitted_at
+                job.last_poll_at = poll_started
+
+            if status == "completed":
+                result_image = status_data.get("output")
+                self._record_completion(job, poll_started, previous_poll_at, result_image)
+                self._complete(job, result_image)
+            elif status in UPSTREAM_PENDING_STATUSES:
+                now = time.time()
+                with self._lock:
+                    if status == 'in_queue':
+                        job.active_since = None
+                    elif job.active_since is None:
+                        job.active_since = now
+
+                    delay = self.poll_policy.next_delay(status, job.active_since, job.last_delay, now)
+                    self._set_status(job, status, last_delay=delay, next_poll_at=now + delay)
+            else:
+                # Failed or unknown status
+                error_message = status_data.get("error", "Unknown error occurred")
+                self._fail(job, 'failed', f'Prediction failed with status: {status}', error_message)
+
+        except UpstreamError as e:
+            # Fashn is shedding load; keep the job and check again later
+            print(f"Deferring status check for try-on job {job.id}: {e}")
+            with self._lock:
+                job.next_poll_at = time.time() + POLLING_INTERVAL
+
+        except Exception as e:
+            self._fail(job, 'failed', f'Status check failed: {str(e)}')
+
+        finally:
+            with self._lock:
+                job.polling = False
+            self._wakeup.set()
+
+    def _record_completion(self, job, detected_at, previous_poll_at, result_image):
+        # Only time spent out of the queue feeds the expected run time
+        active_since = job.active_since or job.submitted_at
+        self.poll_policy.record_completion(detected_at - active_since)
+        self.polling_stats.record(job.polls, detected_at - previous_poll_at, detected_at - job.submitted_at)
+
+        if job.cache_key:
+            result_cache.put(job.cache_key, result_image, job.prediction_id, detected_at - job.submitted_at)
+
+    def stats(self):
+        """Polling efficiency figures for the metrics endpoint"""
+        return self.polling_stats.snapshot(self.poll_policy)
+
+    def _complete(self, job, result_image):
+        history_record = {
+            'user_id': job.user_id,
+            'result_image': result_image,
+            'prediction_id': job.prediction_id,
+            'created_at': time.time()
+        }
+
+        # History references the inputs in the blob store instead of embedding them
+        try:
+            job.model_image_id = store_image(job.model_image, job.user_id)
+            job.garment_image_id = store_image(job.garment_image, job.user_id)
+            history_record['model_image_id'] = job.model_image_id
+            history_record['garment_image_id'] = job.garment_image_id
+            schedule_renditions(job.garment_image_id)
+        except Exception as e:
+            print(f"Error storing try-on images for job {job.id}: {e}")
+            history_record['model_image'] = job.model_image
+            history_record['garment_image'] = job.garment_image
+
+        try:
+            add_history(history_record)
+        except Exception as e:
+            print(f"Error saving try-on history for job {job.id}: {e}")
+
+        with self._lock:
+            self._set_status(job, 'completed', result_image=result_image)
+            if job.garment_image_id:
+                # Finished jobs linger for status lookups; drop the inline images
+                job.model_image = job.garment_image = None
+
+
+def _headers():
+    return {
+        "Authorization": f"Bearer {API_KEY}",
+        "Content-Type": "application/json"
+    }
+
+
+# Shared manager used by the Flask routes
+job_manager = TryOnJobManager()
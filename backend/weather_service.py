@@ -0,0 +1,177 @@
+"""
+Shared weather and IP geolocation lookups.
+
+Coordinates are snapped to a grid of WEATHER_GRID degrees (0.1° is about
+11 km) so everyone in the same cell shares one OpenWeatherMap response,
+kept for WEATHER_TTL seconds. IP geolocation results are kept per client
+IP for GEOIP_TTL seconds. Concurrent lookups of the same cell or IP are
+coalesced: one request goes upstream and the others wait for its answer.
+"""
+import os
+import time
+import ipaddress
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from http_clients import openweather, ip_api
+
+load_dotenv()
+
+WEATHER_API_KEY = os.environ.get('WEATHER_API_KEY') or os.environ.get('OPENWEATHER_API_KEY', '')
+WEATHER_GRID = float(os.environ.get('WEATHER_GRID', '0.1'))  # Degrees per grid cell
+WEATHER_TTL = int(os.environ.get('WEATHER_TTL', '600'))
+GEOIP_TTL = int(os.environ.get('GEOIP_TTL', str(24 * 3600)))
+CACHE_SIZE = int(os.environ.get('WEATHER_CACHE_SIZE', '10000'))
+
+
+class WeatherUnavailable(Exception):
+    """Raised when the weather or geolocation service gives no usable answer"""
+
+    def __init__(self, message, status_code=None, details=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+
+
+class _Flight:
+    """A lookup in progress that other callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class CoalescingCache:
+    """Bounded LRU with a TTL where only one caller at a time loads a missing key"""
+
+    def __init__(self, ttl, max_size=CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        """Cached value for key, calling load() at most once across concurrent callers"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = load()
+        except Exception as e:
+            # Failures are shared with the waiters but never cached
+            flight.error = e
+            with self._lock:
+                self.errors += 1
+            raise
+        else:
+            with self._lock:
+                self._entries[key] = (time.monotonic() + self.ttl, flight.value)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+        return flight.value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'errors': self.errors,
+                'hit_rate': round((self.hits + self.coalesced) / lookups, 3) if lookups else None
+            }
+
+
+def grid_cell(lat, lon, grid=WEATHER_GRID):
+    """Centre of the grid cell holding the coordinates; raises ValueError for invalid ones"""
+    lat, lon = float(lat), float(lon)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError('Latitude must be within ±90 and longitude within ±180')
+    return round(round(lat / grid) * grid, 4), round(round(lon / grid) * grid, 4)
+
+
+def is_public_ip(ip):
+    try:
+        return ipaddress.ip_address(ip).is_global
+    except ValueError:
+        return False
+
+
+class WeatherService:
+    def __init__(self):
+        self.weather = CoalescingCache(WEATHER_TTL)
+        self.locations = CoalescingCache(GEOIP_TTL)
+
+    def current(self, lat, lon):
+        """Current OpenWeatherMap conditions for the grid cell holding the coordinates"""
+        cell = grid_cell(lat, lon)
+        return self.weather.get(cell, lambda: self._fetch_weather(*cell))
+
+    def locate(self, ip=None):
+        """(city, lat, lon) of a client IP; private or unknown IPs resolve to the server's location"""
+        ip = ip if ip and is_public_ip(ip) else None
+        return self.locations.get(ip or 'server', lambda: self._fetch_location(ip))
+
+    def _fetch_weather(self, lat, lon):
+        response = openweather.get(
+            "https://api.openweathermap.org/data/2.5/weather",
+            params={'lat': lat, 'lon': lon, 'appid': WEATHER_API_KEY, 'units': 'metric'}
+        )
+        if response.status_code != 200:
+            raise WeatherUnavailable(
+                f'Weather API request failed with status code {response.status_code}',
+                response.status_code, response.text
+            )
+        return response.json()
+
+    def _fetch_location(self, ip):
+        response = ip_api.get(f"http://ip-api.com/json/{ip or ''}")
+        info = response.json() if response.status_code == 200 else {}
+        if info.get('status') != 'success':
+            raise WeatherUnavailable(
+                f"IP geolocation failed: {info.get('message', response.status_code)}",
+                response.status_code, response.text
+            )
+        return info['city'], info['lat'], info['lon']
+
+    def stats(self):
+        return {'weather': self.weather.stats(), 'geolocation': self.locations.stats()}
+
+
+# Shared by the weather route and the suggestion helpers
+weather_service = WeatherService()
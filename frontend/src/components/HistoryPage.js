@@ -9,23 +9,32 @@ function HistoryPage() {
   const [selectedItem, setSelectedItem] = useState(null);
   const { currentUser, token } = useAuth();
 
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+
+  const fetchHistoryPage = async (cursor) => {
+    const url = cursor ? `/api/history?cursor=${encodeURIComponent(cursor)}` : '/api/history';
+    const response = await fetch(url, {
+      headers: {
+        'Authorization': `Bearer ${token}`
+      }
+    });
+
+    if (!response.ok) {
+      throw new Error('Failed to fetch history');
+    }
+
+    return response.json();
+  };
+
   useEffect(() => {
     const fetchHistory = async () => {
       try {
         setLoading(true);
         
-        const response = await fetch('/api/history', {
-          headers: {
-            'Authorization': `Bearer ${token}`
-          }
-        });
-        
-        if (!response.ok) {
-          throw new Error('Failed to fetch history');
-        }
-        
-        const data = await response.json();
-        setHistory(data);
+        const data = await fetchHistoryPage(null);
+        setHistory(data.items);
+        setNextCursor(data.next_cursor);
         setError(null);
       } catch (err) {
         setError(err.message || 'An error occurred while fetching your history');
@@ -38,8 +47,22 @@ function HistoryPage() {
     if (token) {
       fetchHistory();
     }
+    // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [token]);
 
+  const loadMore = async () => {
+    try {
+      setLoadingMore(true);
+      const data = await fetchHistoryPage(nextCursor);
+      setHistory((previous) => [...previous, ...data.items]);
+      setNextCursor(data.next_cursor);
+    } catch (err) {
+      console.error('Error fetching more history:', err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const openDetailModal = (item) => {
     setSelectedItem(item);
   };
@@ -109,7 +132,7 @@ function HistoryPage() {
             {history.map((item) => (
               <div key={item.id} className="history-card" onClick={() => openDetailModal(item)}>
                 <div className="history-image">
-                  <img src={item.result_image} alt="Try-on result" />
+                  <img src={item.result_image} alt="Try-on result" loading="lazy" />
                   <div className="view-details">
                     <button className="btn btn-small">
                       <i className="fas fa-search-plus"></i> View Details
@@ -135,6 +158,14 @@ function HistoryPage() {
             ))}
           </div>
         )}
+
+        {nextCursor && (
+          <div className="history-load-more">
+            <button className="btn btn-secondary" onClick={loadMore} disabled={loadingMore}>
+              {loadingMore ? 'Loading...' : 'Load More'}
+            </button>
+          </div>
+        )}
         
         {/* Detail Modal */}
         {selectedItem && (
@@ -151,7 +182,7 @@ function HistoryPage() {
               <div className="detail-images">
                 <div className="detail-image">
                   <h4>Original Garment</h4>
-                  <img src={selectedItem.garment_image} alt="Original garment" />
+                  <img src={selectedItem.garment_medium || selectedItem.garment_image} alt="Original garment" />
                 </div>
                 <div className="detail-image">
                   <h4>Try-On Result</h4>
@@ -183,7 +183,7 @@ const MyPhotos = ({ onPhotoSelect, selectedPhotoId, isSelectionMode = false }) =
               onClick={isSelectionMode ? () => onPhotoSelect(photo.id) : undefined}
             >
               <div className="photo-image">
-                <img src={photo.image} alt={photo.name} />
+                <img src={photo.thumbnail || photo.image} alt={photo.name} />
                 {isSelectionMode && selectedPhotoId === photo.id && (
                   <div className="selection-indicator">
                     <i className="fas fa-check-circle"></i>
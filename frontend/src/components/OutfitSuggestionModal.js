@@ -6,6 +6,7 @@ const OutfitSuggestionModal = ({ isOpen, onClose, weather }) => {
     const [loading, setLoading] = useState(false);
     const [outfits, setOutfits] = useState(null);
     const [error, setError] = useState(null);
+    const [quickMode, setQuickMode] = useState(false);
     const { token } = useAuth();
 
     const handleSubmit = async (e) => {
@@ -17,17 +18,21 @@ const OutfitSuggestionModal = ({ isOpen, onClose, weather }) => {
 
         setLoading(true);
         setError(null);
+        let received = 0;
 
         try {
+            // Outfits arrive as server-sent events, each as soon as the stylist finishes it
             const response = await fetch('/api/outfit-suggestions', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream',
                     'Authorization': `Bearer ${token}`
                 },
                 body: JSON.stringify({
                     occasion,
-                    weatherData: weather
+                    weatherData: weather,
+                    mode: quickMode ? 'local' : 'llm'
                 })
             });
 
@@ -35,10 +40,47 @@ const OutfitSuggestionModal = ({ isOpen, onClose, weather }) => {
                 throw new Error('Failed to get outfit suggestions');
             }
 
-            const data = await response.json();
-            setOutfits(data.outfits);
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let finished = false;
+
+            while (!finished) {
+                const { value, done } = await reader.read();
+                if (done) {
+                    throw new Error('Lost connection while generating outfits');
+                }
+
+                buffer += decoder.decode(value, { stream: true });
+                const events = buffer.split('\n\n');
+                buffer = events.pop();
+
+                for (const event of events) {
+                    const lines = event.split('\n');
+                    const eventLine = lines.find((line) => line.startsWith('event: '));
+                    const dataLine = lines.find((line) => line.startsWith('data: '));
+                    if (!eventLine || !dataLine) {
+                        continue;
+                    }
+
+                    const type = eventLine.slice(7);
+                    const data = JSON.parse(dataLine.slice(6));
+
+                    if (type === 'outfit') {
+                        received += 1;
+                        setOutfits((previous) => [...(previous || []), data]);
+                    } else if (type === 'done') {
+                        finished = true;
+                    } else if (type === 'error') {
+                        throw new Error(data.error);
+                    }
+                }
+            }
         } catch (err) {
-            setError('Error generating outfit suggestions. Please try again.');
+            // Keep any outfits that already arrived
+            if (!received) {
+                setError('Error generating outfit suggestions. Please try again.');
+            }
             console.error('Error getting outfit suggestions:', err);
         } finally {
             setLoading(false);
@@ -100,6 +142,17 @@ const OutfitSuggestionModal = ({ isOpen, onClose, weather }) => {
                                         ></textarea>
                                     </div>
 
+                                    <div className="form-group">
+                                        <label className="checkbox-label">
+                                            <input
+                                                type="checkbox"
+                                                checked={quickMode}
+                                                onChange={(e) => setQuickMode(e.target.checked)}
+                                            />
+                                            {' '}Quick suggestions (instant, without the AI stylist)
+                                        </label>
+                                    </div>
+
                                     {weather && (
                                         <div className="weather-info-box">
                                             <h4>Current Weather</h4>
@@ -170,10 +223,16 @@ const OutfitSuggestionModal = ({ isOpen, onClose, weather }) => {
                                             </div>
                                         </div>
                                     ))}
+                                    {loading && (
+                                        <div className="outfit-card outfit-card-pending">
+                                            <div className="loader-small"></div>
+                                            <p>Styling more outfits...</p>
+                                        </div>
+                                    )}
                                 </div>
 
                                 <div className="form-actions">
-                                    <button type="button" className="btn btn-secondary" onClick={handleReset}>
+                                    <button type="button" className="btn btn-secondary" onClick={handleReset} disabled={loading}>
                                         Try Another Occasion
                                     </button>
                                     <button type="button" className="btn btn-primary" onClick={handleClose}>
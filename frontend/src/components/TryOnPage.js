@@ -4,10 +4,18 @@ import UploadForm from './UploadForm';
 import ResultDisplay from './ResultDisplay';
 import { useAuth } from './AuthContext';
 
+const PROGRESS_LABELS = {
+  queued: 'Sending your photos...',
+  starting: 'Starting the try-on...',
+  in_queue: 'Waiting in queue...',
+  processing: 'Generating your try-on...'
+};
+
 function TryOnPage() {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
   const [result, setResult] = useState(null);
+  const [progress, setProgress] = useState(null);
   const { currentUser, isAuthenticated, token } = useAuth();
   const navigate = useNavigate();
 
@@ -18,10 +26,68 @@ function TryOnPage() {
     }
   }, [isAuthenticated, navigate]);
 
+  // Read the job's server-sent event stream until it finishes. EventSource
+  // cannot send the Authorization header, so the stream is parsed by hand.
+  // The server closes each stream after a short while; we then reconnect.
+  const waitForJob = async (eventsUrl) => {
+    while (true) {
+      const response = await fetch(eventsUrl, {
+        headers: {
+          'Authorization': `Bearer ${token}`
+        }
+      });
+
+      if (!response.ok) {
+        const data = await response.json();
+        throw new Error(data.error || 'Something went wrong');
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+          break;
+        }
+
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+
+        for (const event of events) {
+          const lines = event.split('\n');
+          if (!lines.includes('event: status')) {
+            continue;
+          }
+          const dataLine = lines.find((line) => line.startsWith('data: '));
+          if (!dataLine) {
+            continue;
+          }
+
+          const job = JSON.parse(dataLine.slice(6));
+          setProgress(job.status);
+
+          if (job.status === 'completed') {
+            reader.cancel();
+            return job;
+          }
+
+          if (job.status === 'failed' || job.status === 'timeout') {
+            reader.cancel();
+            throw new Error(job.error || 'Something went wrong');
+          }
+        }
+      }
+    }
+  };
+
   const handleSubmit = async (formData, usingSavedPhoto = false) => {
     setLoading(true);
     setError(null);
     setResult(null);
+    setProgress(null);
     
     try {
       // Make sure we have a token
@@ -47,12 +113,21 @@ function TryOnPage() {
         throw new Error(data.error || 'Something went wrong');
       }
       
-      setResult(data);
+      // The try-on runs in the background; wait for the queued job to finish
+      // Cached try-ons come back already completed
+      if (data.status === 'completed') {
+        setResult(data);
+        return;
+      }
+
+      setProgress(data.status);
+      setResult(await waitForJob(data.events_url));
     } catch (err) {
       setError(err.message || 'An error occurred while processing your request');
       console.error('Try-on error:', err);
     } finally {
       setLoading(false);
+      setProgress(null);
     }
   };
 
@@ -85,6 +160,10 @@ function TryOnPage() {
         {!result && (
           <UploadForm onSubmit={handleSubmit} loading={loading} />
         )}
+
+        {loading && progress && PROGRESS_LABELS[progress] && (
+          <p className="try-on-progress">{PROGRESS_LABELS[progress]}</p>
+        )}
         
         {error && (
           <div className="error-message">
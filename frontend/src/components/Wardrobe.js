@@ -306,7 +306,7 @@ function Wardrobe() {
         <div className="item-image">
           {item.images && Array.isArray(item.images) && item.images.length > 0 ? (
             <img
-              src={item.images[0]}
+              src={item.thumbnails?.[0] || item.images[0]}
               alt={item.name || "Wardrobe item"}
               onError={(e) => {
                 e.target.onerror = null;
@@ -539,7 +539,7 @@ function Wardrobe() {
                   >
                     <div className="item-image">
                     {item.images && item.images.length > 0 ? (
-                      <img src={item.images[0]} alt={item.name || item.description} />
+                      <img src={item.thumbnails?.[0] || item.images[0]} alt={item.name || item.description} />
                       ) : (
                         <div className="no-image">
                           <i className="fas fa-tshirt"></i>
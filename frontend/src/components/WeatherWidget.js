@@ -19,9 +19,9 @@ function WeatherWidget({ onWeatherUpdate = () => {} }) {
           });
         },
         err => {
+          // The server can still locate us approximately from our IP address
           console.error('Error getting location:', err);
-          setError('Could not determine your location. Weather information is unavailable.');
-          setLoading(false);
+          setLocation({});
         }
       );
     } else {
@@ -42,7 +42,8 @@ function WeatherWidget({ onWeatherUpdate = () => {} }) {
 
     try {
       setLoading(true);
-      const response = await fetch(`/api/weather?lat=${location.lat}&lon=${location.lon}`, {
+      const query = location.lat !== undefined ? `?lat=${location.lat}&lon=${location.lon}` : '';
+      const response = await fetch(`/api/weather${query}`, {
         headers: {
           'Authorization': `Bearer ${token}`
         }
@@ -76,10 +77,12 @@ function WeatherWidget({ onWeatherUpdate = () => {} }) {
 
   const getOutfitRecommendation = async (weatherData) => {
     try {
+      // The recommendation streams in as server-sent 'delta' events
       const response = await fetch('/api/suggest-outfit', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Accept': 'text/event-stream',
           'Authorization': `Bearer ${token}`
         },
         body: JSON.stringify({
@@ -87,10 +90,44 @@ function WeatherWidget({ onWeatherUpdate = () => {} }) {
           wardrobe: []
         })
       });
-      console.log("Weather:", weather)
-  
-      const data = await response.json();
-      setOutfitSuggestion(data.recommendation);
+
+      if (!response.ok) {
+        throw new Error('Failed to fetch outfit suggestion');
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      setOutfitSuggestion('');
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+          break;
+        }
+
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+
+        for (const event of events) {
+          const lines = event.split('\n');
+          const eventLine = lines.find((line) => line.startsWith('event: '));
+          const dataLine = lines.find((line) => line.startsWith('data: '));
+          if (!eventLine || !dataLine) {
+            continue;
+          }
+
+          const data = JSON.parse(dataLine.slice(6));
+          if (eventLine === 'event: delta') {
+            setOutfitSuggestion((previous) => previous + data.text);
+          } else if (eventLine === 'event: done') {
+            setOutfitSuggestion(data.recommendation);
+          } else if (eventLine === 'event: error') {
+            throw new Error(data.error);
+          }
+        }
+      }
     } catch (err) {
       console.error('Failed to fetch GPT outfit suggestion:', err);
       setOutfitSuggestion('Could not load smart outfit suggestion.');